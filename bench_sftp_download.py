@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Benchmark download_all_refunds.download_files_parallel against a local SFTP stand-in.
+
+Starts a paramiko SFTP server on localhost serving generated files, with an
+artificial delay per read request to stand in for the round trip to the
+Paystack server (localhost has none, so every worker count would look alike).
+Each worker count downloads the full set into a fresh directory and the
+aggregate throughput is printed.
+
+    python bench_sftp_download.py --files 16 --size-mb 4 --latency-ms 5 --workers 1,2,4,8
+"""
+
+import os
+import time
+import socket
+import logging
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+
+import paramiko
+
+from download_all_refunds import download_files_parallel
+
+BENCH_USER = "bench"
+BENCH_PASS = "bench"
+
+
+class _Server(paramiko.ServerInterface):
+    """Accepts the bench user and SFTP sessions"""
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        if (username, password) == (BENCH_USER, BENCH_PASS):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+
+class _Handle(paramiko.SFTPHandle):
+    """Read-only file handle that waits latency seconds per read request"""
+
+    latency = 0.0
+
+    def read(self, offset, length):
+        time.sleep(self.latency)
+        return super().read(offset, length)
+
+
+class _SFTPRoot(paramiko.SFTPServerInterface):
+    """Serves the files under root (read-only, flat)"""
+
+    root = None
+
+    def _local(self, path):
+        return os.path.join(self.root, os.path.basename(path))
+
+    def list_folder(self, path):
+        return [
+            paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(self.root, name)), name)
+            for name in sorted(os.listdir(self.root))
+        ]
+
+    def stat(self, path):
+        return paramiko.SFTPAttributes.from_stat(os.stat(self._local(path)), os.path.basename(path))
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        handle = _Handle(flags)
+        handle.readfile = open(self._local(path), "rb")
+        return handle
+
+
+def serve_sftp(root, latency):
+    """Start an SFTP server for root on a free localhost port in the background; returns the port"""
+    host_key = paramiko.RSAKey.generate(2048)
+    _SFTPRoot.root = str(root)
+    _Handle.latency = latency
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(8)
+
+    def accept():
+        while True:
+            conn, _ = listener.accept()
+            transport = paramiko.Transport(conn)
+            transport.add_server_key(host_key)
+            transport.set_subsystem_handler("sftp", paramiko.SFTPServer, _SFTPRoot)
+            transport.start_server(server=_Server())
+
+    threading.Thread(target=accept, name="bench-sftp-server", daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def make_files(root: Path, count, size):
+    """Write count files of size random bytes, named like refund exports"""
+    for i in range(count):
+        (root / f"2024-01-{i % 28 + 1:02d}_refunds_{i:04d}.csv").write_bytes(os.urandom(size))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=16, help="number of remote files")
+    parser.add_argument("--size-mb", type=float, default=4, help="size of each file in MB")
+    parser.add_argument("--latency-ms", type=float, default=5, help="server delay per read request")
+    parser.add_argument("--workers", default="1,2,4,8", help="comma-separated SFTP_WORKERS values to compare")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    # The server side logs every client disconnect as a socket error
+    logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        remote = Path(tmp) / "remote"
+        remote.mkdir()
+        make_files(remote, args.files, int(args.size_mb * 1e6))
+        port = serve_sftp(remote, args.latency_ms / 1000)
+
+        print(f"{args.files} files × {args.size_mb} MB, {args.latency_ms} ms per read request")
+        print(f"{'workers':>8} {'seconds':>8} {'MB/s':>8}")
+        for workers in (int(w) for w in args.workers.split(",")):
+            transport = paramiko.Transport(("127.0.0.1", port))
+            transport.connect(username=BENCH_USER, password=BENCH_PASS)
+            sftp = paramiko.SFTPClient.from_transport(transport)
+            attrs = sftp.listdir_attr("/")
+            local = Path(tmp) / f"local_{workers}"
+            local.mkdir()
+            try:
+                start = time.monotonic()
+                results = download_files_parallel(transport, "/", attrs, local, workers=workers)
+                elapsed = time.monotonic() - start
+            finally:
+                sftp.close()
+                transport.close()
+            failed = sum(1 for _, path in results if path is None)
+            total_mb = sum(path.stat().st_size for _, path in results if path is not None) / 1e6
+            note = f"  ({failed} failed)" if failed else ""
+            print(f"{workers:>8} {elapsed:>8.2f} {total_mb / elapsed:>8.2f}{note}")
+
+
+if __name__ == "__main__":
+    main()
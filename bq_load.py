@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+BigQuery load helpers shared by the refund uploaders.
+
+Rows are written to typed, zstd-compressed Parquet files straight from Arrow
+and loaded with load_table_from_file, instead of load_table_from_dataframe
+re-serializing a pandas frame in memory. The Parquet files are kept under
+PARQUET_DIR so a load can be repeated without reparsing the CSVs.
+"""
+
+import uuid
+import hashlib
+import logging
+import itertools
+from pathlib import Path
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from google.api_core.exceptions import Conflict, GoogleAPICallError
+from google.cloud import bigquery
+
+from refund_schema import BIGQUERY_SCHEMA, ARROW_SCHEMA, SCHEMA_COLUMNS, SCHEMA_TYPES
+
+# Column that identifies a refund row across files and runs
+MERGE_KEY = "unique_id"
+
+# The refunds table is partitioned by day on this column
+PARTITION_FIELD = "created_at"
+
+# Partition decorator BigQuery uses for rows whose partition column is NULL
+NULL_PARTITION = "__NULL__"
+
+# Clustering keys, in order of how selective dashboard filters on them are
+# (status and currency first, then channel and merchant integration).
+# BigQuery allows at most four.
+CLUSTERING_FIELDS = ["status", "currency", "channel", "integration"]
+if not all(SCHEMA_TYPES.get(f) in ("STRING", "INTEGER") for f in CLUSTERING_FIELDS):
+    raise ValueError(f"Clustering fields {CLUSTERING_FIELDS} must be STRING or INTEGER schema columns")
+
+# Parquet artifacts
+PARQUET_DIR = Path("parquet")
+PARQUET_COMPRESSION = "zstd"
+PARQUET_ROW_GROUP_ROWS = 128 * 1024
+
+# Timestamps are written as UTC microseconds, which BigQuery reads as TIMESTAMP
+PARQUET_SCHEMA = pa.schema(
+    [
+        pa.field(f.name, pa.timestamp("us", tz="UTC")) if pa.types.is_timestamp(f.type) else f
+        for f in ARROW_SCHEMA
+    ]
+)
+
+
+def ensure_table(client: bigquery.Client, table: str, partition_field: str = PARTITION_FIELD):
+    """
+    Provision table from BIGQUERY_SCHEMA: day-partitioned on partition_field and
+    clustered on CLUSTERING_FIELDS. An existing table keeps its partitioning
+    (that can't be changed in place) but gets its clustering brought up to date.
+    """
+    definition = bigquery.Table(table, schema=BIGQUERY_SCHEMA)
+    definition.time_partitioning = bigquery.TimePartitioning(
+        type_=bigquery.TimePartitioningType.DAY, field=partition_field
+    )
+    definition.clustering_fields = CLUSTERING_FIELDS
+    existing = client.create_table(definition, exists_ok=True)
+    if existing.clustering_fields != CLUSTERING_FIELDS:
+        logging.info(f"Setting clustering on {table} to {CLUSTERING_FIELDS}")
+        existing.clustering_fields = CLUSTERING_FIELDS
+        client.update_table(existing, ["clustering_fields"])
+
+
+def sort_for_clustering(table: pa.Table) -> pa.Table:
+    """Order rows by the clustering keys so loaded blocks are already clustered"""
+    # Arrow can't sort on dictionary columns directly, so sort on decoded copies of the keys
+    keys = pa.table({f: decode_dictionary(table.column(f)) for f in CLUSTERING_FIELDS})
+    return table.take(pc.sort_indices(keys, sort_keys=[(f, "ascending") for f in CLUSTERING_FIELDS]))
+
+
+def decode_dictionary(column):
+    """Plain values of a dictionary-encoded column; other columns are returned as is"""
+    if pa.types.is_dictionary(column.type):
+        return column.cast(column.type.value_type)
+    return column
+
+
+def to_arrow(df: pd.DataFrame) -> pa.Table:
+    """Convert an enforce_schema() frame to a refunds Arrow table"""
+    return pa.Table.from_pandas(df, schema=ARROW_SCHEMA, preserve_index=False)
+
+
+def to_parquet_schema(table: pa.Table) -> pa.Table:
+    """Cast a refunds table to PARQUET_SCHEMA (naive timestamps are taken as UTC, sub-µs digits dropped)"""
+    return table.cast(PARQUET_SCHEMA, safe=False)
+
+
+def open_parquet_writer(path: Path) -> pq.ParquetWriter:
+    """ParquetWriter with the pipeline's schema and compression settings"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return pq.ParquetWriter(path, PARQUET_SCHEMA, compression=PARQUET_COMPRESSION)
+
+
+def write_parquet(table: pa.Table, path: Path) -> Path:
+    """Write a refunds table to path, sorted for clustering, in PARQUET_ROW_GROUP_ROWS row groups"""
+    with open_parquet_writer(path) as writer:
+        writer.write_table(to_parquet_schema(sort_for_clustering(table)), row_group_size=PARQUET_ROW_GROUP_ROWS)
+    return path
+
+
+def job_id_for(destination: str, mode: str, hashes) -> str:
+    """Deterministic BigQuery job ID for loading the files with these content hashes into destination"""
+    digest = hashlib.sha256(f"{destination}|{mode}".encode())
+    for sha256 in sorted(hashes):
+        digest.update(sha256.encode())
+    return f"refunds_{mode}_{digest.hexdigest()[:32]}"
+
+
+def submit_once(client: bigquery.Client, job_id, submit):
+    """
+    Start a job with submit(job_id) unless one already ran under that ID.
+    If an earlier run already started job_id and it succeeded, that job is
+    returned and nothing is submitted again. If it failed, the job is retried
+    as job_id_1, job_id_2, ... With job_id None, BigQuery picks a random ID.
+    """
+    if job_id is None:
+        return submit(None)
+    for attempt in itertools.count():
+        attempt_id = job_id if attempt == 0 else f"{job_id}_{attempt}"
+        try:
+            return submit(attempt_id)
+        except Conflict:
+            job = client.get_job(attempt_id)
+            try:
+                job.result()
+            except GoogleAPICallError as e:
+                logging.warning(f"Earlier job {attempt_id} failed ({e}), retrying")
+                continue
+            logging.info(f"Job {attempt_id} already completed, not submitting it again")
+            return job
+
+
+def load_parquet(client: bigquery.Client, path: Path, destination: str, write_disposition: str, job_id=None) -> int:
+    """Load one Parquet file into destination and wait for it; returns rows loaded"""
+    job_config = bigquery.LoadJobConfig(
+        schema=BIGQUERY_SCHEMA,
+        source_format=bigquery.SourceFormat.PARQUET,
+        write_disposition=write_disposition,
+    )
+
+    def submit(attempt_id):
+        with open(path, "rb") as f:
+            return client.load_table_from_file(f, destination, job_config=job_config, job_id=attempt_id)
+
+    logging.info(f"Uploading {path} to {destination} ({write_disposition}) ...")
+    job = submit_once(client, job_id, submit)
+    job.result()
+    logging.info(f"Loaded {job.output_rows} rows into {destination}")
+    return job.output_rows
+
+
+def load_table(
+    client: bigquery.Client, table: pa.Table, destination: str, name: str, write_disposition: str, job_id=None
+) -> int:
+    """Write table to PARQUET_DIR/<name>.parquet and load it into destination"""
+    path = write_parquet(table, PARQUET_DIR / f"{name}.parquet")
+    return load_parquet(client, path, destination, write_disposition, job_id)
+
+
+def build_merge_sql(
+    target: str, staging: str, key: str = MERGE_KEY, columns=SCHEMA_COLUMNS, days=None, partition_field=PARTITION_FIELD
+) -> str:
+    """
+    MERGE statement that upserts every staging row into target on key. With
+    days = (first, last) UTC dates, the ON clause also limits target rows to
+    those partitions, so BigQuery scans only them instead of the whole table.
+    """
+    on = f"T.`{key}` = S.`{key}`"
+    if days is not None:
+        first, last = days
+        after = last + timedelta(days=1)
+        on += (
+            f"\n  AND T.`{partition_field}` >= TIMESTAMP '{first.isoformat()}'"
+            f" AND T.`{partition_field}` < TIMESTAMP '{after.isoformat()}'"
+        )
+    updates = ",\n    ".join(f"`{c}` = S.`{c}`" for c in columns if c != key)
+    names = ", ".join(f"`{c}`" for c in columns)
+    values = ", ".join(f"S.`{c}`" for c in columns)
+    return (
+        f"MERGE `{target}` T\n"
+        f"USING `{staging}` S\n"
+        f"ON {on}\n"
+        f"WHEN MATCHED THEN UPDATE SET\n    {updates}\n"
+        f"WHEN NOT MATCHED THEN INSERT ({names})\n"
+        f"VALUES ({values})"
+    )
+
+
+def partition_days(table: pa.Table, partition_field: str = PARTITION_FIELD):
+    """(first, last) UTC day of the non-null partition_field values, or None if there are none"""
+    column = table.column(partition_field)
+    if column.type.tz is not None:
+        column = column.cast(pa.timestamp(column.type.unit))
+    bounds = pc.min_max(column.cast(pa.date32()))
+    if not bounds["min"].is_valid:
+        return None
+    return bounds["min"].as_py(), bounds["max"].as_py()
+
+
+def dedupe_on_key(table: pa.Table, key: str = MERGE_KEY) -> pa.Table:
+    """Drop rows without a key and keep only the last row for each duplicate key"""
+    table = table.filter(pc.is_valid(table.column(key)))
+    rows = table.append_column("__row", pa.array(range(table.num_rows), pa.int64()))
+    last = rows.group_by(key).aggregate([("__row", "max")]).column("__row_max")
+    # last holds row numbers; sorting them keeps the surviving rows in file order
+    return table.take(last.take(pc.sort_indices(last)))
+
+
+def merge_upsert(client: bigquery.Client, table: pa.Table, target: str, name: str, key: str = MERGE_KEY, job_id=None):
+    """
+    Upsert table into target: load it into a uniquely named staging table, MERGE
+    on key, then drop the staging table. The MERGE is limited to the target
+    partitions of the rows' created_at days (a refund keeps its created_at), so
+    cost scales with those days, not with the target size. Rows without a
+    created_at can match anywhere and are merged separately without that limit.
+    Rows without a key are dropped; duplicate keys keep the last row.
+    job_id, if given, is used for the MERGE itself (see submit_once).
+    """
+    rows = dedupe_on_key(table, key)
+    if rows.num_rows < table.num_rows:
+        logging.warning(f"Dropped {table.num_rows - rows.num_rows} rows with a missing or duplicate {key}")
+
+    ensure_table(client, target)
+    dated = pc.is_valid(rows.column(PARTITION_FIELD))
+    undated = rows.filter(pc.invert(dated))
+    _merge_staged(client, rows.filter(dated), target, name, key, job_id, pruned=True)
+    if undated.num_rows:
+        logging.warning(f"{undated.num_rows} rows have no {PARTITION_FIELD}; merging them against the whole table")
+        undated_job_id = f"{job_id}_undated" if job_id else None
+        _merge_staged(client, undated, target, f"{name}_undated", key, undated_job_id, pruned=False)
+
+
+def _merge_staged(client: bigquery.Client, rows: pa.Table, target: str, name: str, key: str, job_id, pruned: bool):
+    """Stage rows, MERGE them into target (limited to their partition days if pruned) and drop the staging table"""
+    if rows.num_rows == 0:
+        return
+    staging = f"{target}_staging_{uuid.uuid4().hex[:12]}"
+    logging.info(f"Loading {rows.num_rows} rows into staging table {staging}")
+    load_table(client, rows, staging, name, "WRITE_TRUNCATE")
+
+    try:
+        days = partition_days(rows) if pruned else None
+        scope = f" partitions {days[0]}..{days[1]}" if days else ""
+        logging.info(f"Merging {staging} into {target}{scope} on {key}")
+        sql = build_merge_sql(target, staging, key, days=days)
+        job = submit_once(client, job_id, lambda attempt_id: client.query(sql, job_id=attempt_id))
+        job.result()
+        logging.info(f"Merge complete. {job.num_dml_affected_rows} rows inserted or updated.")
+    finally:
+        client.delete_table(staging, not_found_ok=True)
+
+
+def partition_ids(table: pa.Table, partition_field: str = PARTITION_FIELD) -> pa.Array:
+    """YYYYMMDD partition id (UTC day) of every row, NULL_PARTITION where the field is empty"""
+    column = table.column(partition_field)
+    if pa.types.is_timestamp(column.type) and column.type.tz is None:
+        column = column.cast(pa.timestamp(column.type.unit, tz="UTC"))
+    return pc.fill_null(pc.strftime(column, format="%Y%m%d"), NULL_PARTITION)
+
+
+def load_partitions(
+    client: bigquery.Client,
+    table: pa.Table,
+    destination: str,
+    partition_field: str = PARTITION_FIELD,
+    max_parallel: int = 4,
+    job_id=None,
+):
+    """
+    Load table one day-partition at a time into 'destination$YYYYMMDD' with
+    WRITE_TRUNCATE, so every partition present in table is replaced by exactly
+    its rows and all other partitions are left alone. Each day is written to
+    its own Parquet file and independent days load as parallel jobs, named
+    job_id_YYYYMMDD if job_id is given.
+    """
+    ensure_table(client, destination, partition_field)
+    existing = client.get_table(destination).time_partitioning
+    if existing is None or existing.field != partition_field:
+        raise ValueError(f"{destination} is not day-partitioned on {partition_field}; recreate it before partition loads")
+
+    ids = partition_ids(table, partition_field)
+    days = sorted(pc.unique(ids).to_pylist())
+
+    def load(day):
+        rows = table.filter(pc.equal(ids, day))
+        day_job_id = f"{job_id}_{day}" if job_id else None
+        return load_table(
+            client, rows, f"{destination}${day}", f"{partition_field}={day}", "WRITE_TRUNCATE", day_job_id
+        )
+
+    logging.info(f"Loading {table.num_rows} rows into {len(days)} partitions of {destination}")
+    with ThreadPoolExecutor(max_workers=max_parallel) as pool:
+        loaded = sum(pool.map(load, days))
+    logging.info(f"Upload complete. {loaded} rows loaded.")
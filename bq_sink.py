@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Destinations for parsed refund tables.
+
+A sink receives one schema-typed Arrow table per parsed file through write()
+and finishes the upload in close(). LoadJobSink batches everything into a
+single load job, PerFileLoadSink loads each file as soon as it is written, and
+StorageWriteSink streams each table through the BigQuery Storage Write API.
+Any RefundSink subclass (e.g. an in-memory fake) can stand in for them.
+"""
+
+import logging
+from abc import ABC, abstractmethod
+
+import pyarrow as pa
+from google.cloud import bigquery
+from google.cloud.bigquery_storage_v1 import BigQueryWriteClient, types, writer
+
+from bq_load import ensure_table, to_parquet_schema, PARQUET_SCHEMA
+
+# Rows per AppendRows request; keeps each request well under the 10 MB limit
+STORAGE_WRITE_BATCH_ROWS = 5000
+
+# Record batches are serialized without their dictionaries, so dictionary columns are sent decoded
+STORAGE_WRITE_SCHEMA = pa.schema(
+    [pa.field(f.name, f.type.value_type) if pa.types.is_dictionary(f.type) else f for f in PARQUET_SCHEMA]
+)
+
+STORAGE_WRITE_MODES = {
+    "committed": types.WriteStream.Type.COMMITTED,
+    "pending": types.WriteStream.Type.PENDING,
+}
+
+
+class RefundSink(ABC):
+    """Interface: write(table) per parsed file, optional flush(), close() → total rows written"""
+
+    @abstractmethod
+    def write(self, table: pa.Table):
+        """Send (or queue) one parsed file's rows"""
+
+    @abstractmethod
+    def close(self) -> int:
+        """Finish the upload; returns the total rows written"""
+
+    def flush(self):
+        """Wait until every table written so far has reached BigQuery (no-op for sinks that send on close)"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+
+
+class LoadJobSink(RefundSink):
+    """Collect tables and hand them to upload(table) as one batch load on close"""
+
+    def __init__(self, upload):
+        self.upload = upload
+        self.tables = []
+
+    def write(self, table: pa.Table):
+        self.tables.append(table)
+
+    def close(self) -> int:
+        if not self.tables:
+            return 0
+        refunds = pa.concat_tables(self.tables)
+        self.tables = []
+        self.upload(refunds)
+        return refunds.num_rows
+
+
+class PerFileLoadSink(RefundSink):
+    """
+    Hand each table to upload(table) as soon as it is written, so every file is
+    loaded on its own. Only for write modes where per-file loads compose (MERGE).
+    """
+
+    def __init__(self, upload):
+        self.upload = upload
+        self.rows = 0
+
+    def write(self, table: pa.Table):
+        self.upload(table)
+        self.rows += table.num_rows
+
+    def close(self) -> int:
+        return self.rows
+
+
+class StorageWriteSink(RefundSink):
+    """
+    Append Arrow record batches to table through the Storage Write API.
+
+    "committed" rows are queryable as soon as each append is acknowledged.
+    "pending" rows become visible atomically when close() commits the stream.
+    """
+
+    def __init__(
+        self,
+        table: str,
+        mode: str = "committed",
+        client: BigQueryWriteClient = None,
+        bq_client: bigquery.Client = None,
+    ):
+        if mode not in STORAGE_WRITE_MODES:
+            raise ValueError(f"Unknown Storage Write mode {mode!r}, expected one of {list(STORAGE_WRITE_MODES)}")
+        self.table = table
+        self.mode = mode
+        self.client = client
+        self.bq_client = bq_client
+        self.stream = None
+        self.append_stream = None
+        self.futures = []
+        self.offset = 0
+
+    def _open(self):
+        """Create the write stream on first use, so runs with no data create nothing"""
+        ensure_table(self.bq_client or bigquery.Client(), self.table)
+        self.client = self.client or BigQueryWriteClient()
+        project, dataset, table_id = self.table.split(".")
+        self.parent = self.client.table_path(project, dataset, table_id)
+        self.stream = self.client.create_write_stream(
+            parent=self.parent,
+            write_stream=types.WriteStream(type_=STORAGE_WRITE_MODES[self.mode]),
+        )
+        template = types.AppendRowsRequest(
+            write_stream=self.stream.name,
+            arrow_rows=types.AppendRowsRequest.ArrowData(
+                writer_schema=types.ArrowSchema(serialized_schema=STORAGE_WRITE_SCHEMA.serialize().to_pybytes())
+            ),
+        )
+        self.append_stream = writer.AppendRowsStream(self.client, template)
+        logging.info(f"Opened {self.mode} write stream {self.stream.name}")
+
+    def write(self, table: pa.Table):
+        if self.stream is None:
+            self._open()
+        rows = to_parquet_schema(table).cast(STORAGE_WRITE_SCHEMA)
+        for batch in rows.to_batches(max_chunksize=STORAGE_WRITE_BATCH_ROWS):
+            request = types.AppendRowsRequest(
+                offset=self.offset,
+                arrow_rows=types.AppendRowsRequest.ArrowData(
+                    rows=types.ArrowRecordBatch(
+                        serialized_record_batch=batch.serialize().to_pybytes(),
+                        row_count=batch.num_rows,
+                    )
+                ),
+            )
+            self.futures.append(self.append_stream.send(request))
+            self.offset += batch.num_rows
+        logging.info(f"Appended {table.num_rows} rows to {self.table} (offset {self.offset})")
+
+    def flush(self):
+        for future in self.futures:
+            future.result()
+        self.futures = []
+
+    def close(self) -> int:
+        if self.stream is None:
+            return 0
+        self.flush()
+        self.append_stream.close()
+        self.client.finalize_write_stream(name=self.stream.name)
+        if self.mode == "pending":
+            response = self.client.batch_commit_write_streams(
+                types.BatchCommitWriteStreamsRequest(parent=self.parent, write_streams=[self.stream.name])
+            )
+            if response.stream_errors:
+                raise RuntimeError(f"Commit of {self.stream.name} failed: {list(response.stream_errors)}")
+        logging.info(f"Storage Write complete. {self.offset} rows written to {self.table}.")
+        self.stream = None
+        return self.offset
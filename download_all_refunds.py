@@ -5,13 +5,20 @@ Connects to Paystack SFTP, finds refund CSV files, and downloads them locally.
 
 import os
 import sys
+import time
+import queue
 import fnmatch
 import logging
 import posixpath  # <-- FIX: use this for SFTP remote paths
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 import paramiko
-import pandas as pd
+
+from sftp_transfer import resumable_download
+from download_manifest import DownloadManifest
+from refund_csv import read_csv_pandas
+from refund_schema import enforce_schema
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
@@ -27,6 +34,9 @@ SFTP_PASS = os.getenv("SFTP_PASS")  # set in .env or environment
 SFTP_REMOTE_DIR = os.getenv("SFTP_REMOTE_DIR", "/refunds")
 SFTP_REMOTE_PATTERN = os.getenv("SFTP_REMOTE_PATTERN", "*.csv")
 
+# Number of concurrent SFTP channels used for downloads (1 = sequential)
+SFTP_WORKERS = int(os.getenv("SFTP_WORKERS", "4"))
+
 # Local folders
 DOWNLOAD_DIR = Path("downloads")
 DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
@@ -46,33 +56,68 @@ def connect_sftp(host, port, username, password, timeout=30):
 
 
 def list_remote_files(sftp, remote_dir, pattern):
-    """List files in remote_dir matching pattern (fnmatch)"""
+    """List SFTPAttributes of files in remote_dir matching pattern (fnmatch)"""
     files = []
     try:
-        names = sftp.listdir(remote_dir)
+        attrs = sftp.listdir_attr(remote_dir)
     except IOError as e:
         logging.error(f"Failed to list directory {remote_dir}: {e}")
         raise
-    for name in names:
-        if fnmatch.fnmatch(name, pattern):
-            files.append(name)
+    for attr in attrs:
+        if fnmatch.fnmatch(attr.filename, pattern):
+            files.append(attr)
     logging.info(f"Found {len(files)} files matching pattern '{pattern}' in {remote_dir}")
     return files
 
 
-def download_file(sftp, remote_dir, filename, local_dir: Path):
-    """Download a single file"""
-    remote_path = posixpath.join(remote_dir, filename)  # FIXED: use posixpath for SFTP
-    local_path = local_dir / filename
+def download_file(sftp, remote_dir, attr, local_dir: Path):
+    """Download a single file (SFTPAttributes from list_remote_files), resuming partial transfers"""
+    remote_path = posixpath.join(remote_dir, attr.filename)  # FIXED: use posixpath for SFTP
+    local_path = local_dir / attr.filename
+    return resumable_download(sftp, remote_path, local_path, attr=attr)
+
+
+def download_files_parallel(transport, remote_dir, attrs, local_dir: Path, workers=SFTP_WORKERS):
+    """
+    Download files concurrently, one SFTP channel per worker over the shared transport.
+    Returns a list of (attr, local_path or None) in completion order.
+    """
+    workers = max(1, min(workers, len(attrs)))
+    channels = queue.Queue()
+    for _ in range(workers):
+        channels.put(paramiko.SFTPClient.from_transport(transport))
 
-    if local_path.exists():
-        logging.info(f"Skipping {filename}, already exists at {local_path}")
-        return local_path
+    def _fetch(attr):
+        sftp = channels.get()
+        try:
+            return download_file(sftp, remote_dir, attr, local_dir)
+        finally:
+            channels.put(sftp)
+
+    results = []
+    start = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_fetch, attr): attr for attr in attrs}
+            for future in as_completed(futures):
+                attr = futures[future]
+                try:
+                    results.append((attr, future.result()))
+                except Exception as e:
+                    logging.error(f"Failed to download {attr.filename}: {e}")
+                    results.append((attr, None))
+    finally:
+        while not channels.empty():
+            channels.get().close()
 
-    logging.info(f"Downloading {remote_path} -> {local_path}")
-    sftp.get(remote_path, str(local_path))
-    logging.info(f"Downloaded {filename}")
-    return local_path
+    elapsed = time.monotonic() - start
+    total_bytes = sum(path.stat().st_size for _, path in results if path is not None)
+    logging.info(
+        f"Downloaded {sum(1 for _, p in results if p is not None)}/{len(attrs)} files, "
+        f"{total_bytes / 1e6:.1f} MB in {elapsed:.1f}s "
+        f"({total_bytes / 1e6 / max(elapsed, 1e-9):.2f} MB/s, {workers} workers)"
+    )
+    return results
 
 
 def main():
@@ -89,20 +134,36 @@ def main():
             logging.info("No matching files found. Exiting.")
             return
 
-        for fname in files:
+        with DownloadManifest(DOWNLOAD_DIR) as manifest:
+            pending = manifest.pending(files)
+            if not pending:
+                logging.info("All remote files already downloaded. Exiting.")
+                return
+
+            if SFTP_WORKERS > 1:
+                downloaded = download_files_parallel(transport, SFTP_REMOTE_DIR, pending, DOWNLOAD_DIR)
+            else:
+                downloaded = []
+                for attr in pending:
+                    try:
+                        downloaded.append((attr, download_file(sftp, SFTP_REMOTE_DIR, attr, DOWNLOAD_DIR)))
+                    except Exception as e:
+                        logging.error(f"Failed to download {attr.filename}: {e}")
+                        continue
+
+            for attr, local_file in downloaded:
+                if local_file is not None:
+                    manifest.record(attr, local_file)
+
+        for attr, local_file in downloaded:
+            if local_file is None:
+                continue
+            # Optional: validate CSV against the BigQuery schema
             try:
-                local_file = download_file(sftp, SFTP_REMOTE_DIR, fname, DOWNLOAD_DIR)
-
-                # Optional: validate/clean CSV with pandas
-                try:
-                    df = pd.read_csv(local_file)
-                    logging.info(f"Validated CSV: {local_file}")
-                except Exception as e:
-                    logging.warning(f"Could not parse CSV with pandas ({local_file}): {e}")
-
+                df = enforce_schema(read_csv_pandas(local_file))
+                logging.info(f"Validated CSV: {local_file} ({len(df)} rows)")
             except Exception as e:
-                logging.error(f"Failed to download {fname}: {e}")
-                continue
+                logging.warning(f"Could not parse CSV with pandas ({local_file}): {e}")
 
     finally:
         try:
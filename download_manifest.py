@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Local SQLite manifest of downloaded SFTP files.
+
+Records each remote file's name, size, mtime and content hash so a run can
+list the remote directory once with listdir_attr() and transfer only the files
+that are new or changed since the last sync.
+
+It also checkpoints each file's upload against that hash, with the BigQuery
+job ID, so a re-run after a failure skips files already uploaded unless their
+content changed. (Parsed tables are checkpointed by the content-addressed
+parquet_cache.ParquetCache instead.)
+"""
+
+import hashlib
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+
+MANIFEST_FILENAME = "manifest.sqlite"
+
+# Per-file stages checkpointed after the download itself
+STAGES = ("upload",)
+
+
+def file_sha256(path: Path, chunk_size=1024 * 1024):
+    """Return the hex sha256 of a local file"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DownloadManifest:
+    """
+    name → (size, mtime, sha256) of every file fetched into local_dir, plus
+    (name, stage) → (sha256, output, job_id) of every completed later stage
+    """
+
+    def __init__(self, local_dir: Path):
+        self.local_dir = Path(local_dir)
+        self.path = self.local_dir / MANIFEST_FILENAME
+        # Shared by the stage threads of a pipeline, one statement at a time
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                name TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                downloaded_at TEXT NOT NULL
+            )
+            """
+        )
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS stages (
+                name TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                sha256 TEXT NOT NULL,
+                output TEXT,
+                job_id TEXT,
+                done_at TEXT NOT NULL,
+                PRIMARY KEY (name, stage)
+            )
+            """
+        )
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def get(self, name):
+        """Return (size, mtime, sha256) for name, or None if never downloaded"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT size, mtime, sha256 FROM files WHERE name = ?", (name,)
+            ).fetchone()
+
+    def sha256(self, name):
+        """Content hash of the downloaded name, or None if never downloaded"""
+        row = self.get(name)
+        return row[2] if row else None
+
+    def pending(self, attrs):
+        """
+        Filter SFTPAttributes down to files that are new, changed, or missing locally.
+        A local file with no manifest row (fetched before the manifest existed,
+        without the remote mtime) is adopted by hashing it when its size matches.
+        """
+        todo, adopted = [], 0
+        for attr in attrs:
+            local_path = self.local_dir / attr.filename
+            row = self.get(attr.filename)
+            if row is None and local_path.exists() and local_path.stat().st_size == attr.st_size:
+                self.record(attr, local_path)
+                adopted += 1
+                continue
+            if row is None or row[0] != attr.st_size or row[1] != int(attr.st_mtime) or not local_path.exists():
+                todo.append(attr)
+        if adopted:
+            logging.info(f"Manifest: adopted {adopted} existing local files without downloading them again")
+        logging.info(f"Manifest: {len(todo)} of {len(attrs)} remote files are new or changed")
+        return todo
+
+    def record(self, attr, local_path: Path):
+        """Record a completed download of attr at local_path"""
+        sha256 = file_sha256(local_path)
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO files (name, size, mtime, sha256, downloaded_at) VALUES (?, ?, ?, ?, ?)",
+                (
+                    attr.filename,
+                    attr.st_size,
+                    int(attr.st_mtime),
+                    sha256,
+                    datetime.now(timezone.utc).isoformat(),
+                ),
+            )
+            self.conn.commit()
+
+    def stage(self, name, stage):
+        """
+        Return (output, job_id) if stage completed for the current download of
+        name, else None. A re-downloaded file with new content invalidates it.
+        """
+        with self.lock:
+            return self.conn.execute(
+                """
+                SELECT s.output, s.job_id FROM stages s JOIN files f ON f.name = s.name
+                WHERE s.name = ? AND s.stage = ? AND s.sha256 = f.sha256
+                """,
+                (name, stage),
+            ).fetchone()
+
+    def mark(self, name, stage, output=None, job_id=None):
+        """Checkpoint stage as completed for the current download of name"""
+        if stage not in STAGES:
+            raise ValueError(f"Unknown stage {stage!r}, expected one of {STAGES}")
+        sha256 = self.sha256(name)
+        if sha256 is None:
+            raise ValueError(f"{name} has no recorded download")
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO stages (name, stage, sha256, output, job_id, done_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (name, stage, sha256, output, job_id, datetime.now(timezone.utc).isoformat()),
+            )
+            self.conn.commit()
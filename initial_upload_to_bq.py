@@ -2,16 +2,36 @@
 """
 Reads refund CSVs from 'downloads/' and loads them into BigQuery table.
 Enforces schema datatypes to avoid mismatches.
+
+With LAKE_INGEST the parsed rows are also written to the local Parquet lake
+(parquet/lake, partitioned by created_at day). With LAKE_SOURCE the upload
+reads from the lake instead, optionally only the days LAKE_FROM..LAKE_TO.
 """
 
 import os
 import glob
 import logging
-import pandas as pd
-import decimal
+from datetime import date
+import pyarrow as pa
+import pyarrow.parquet as pq
 from google.cloud import bigquery
 from dotenv import load_dotenv
 
+from refund_csv import CSV_ENGINES, parse_file_cached, parse_files_parallel, iter_csv_batches
+from parquet_cache import ParquetCache
+from refund_lake import LAKE_DIR, write_lake, read_lake
+from bq_load import (
+    PARQUET_DIR,
+    PARQUET_ROW_GROUP_ROWS,
+    ensure_table,
+    sort_for_clustering,
+    to_parquet_schema,
+    open_parquet_writer,
+    load_parquet,
+    load_table,
+    load_partitions,
+)
+
 # Setup logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 
@@ -24,122 +44,193 @@ PROJECT_ID = os.getenv("BQ_PROJECT")
 DATASET_ID = os.getenv("BQ_DATASET")
 TABLE_ID = os.getenv("BQ_TABLE")
 
+# CSV parser: "pandas" (default) or "pyarrow" (multithreaded, schema-typed)
+CSV_ENGINE = os.getenv("CSV_ENGINE", "pandas")
+
+# Parse files in a process pool when > 1; PARSE_MAX_PENDING caps files in flight (0 = 2 × workers)
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "1"))
+PARSE_MAX_PENDING = int(os.getenv("PARSE_MAX_PENDING", "0"))
+
+# Parsed files are cached as Parquet by content hash; 0 disables the cache
+PARQUET_CACHE_MAX_MB = int(os.getenv("PARQUET_CACHE_MAX_MB", "10240"))
+
+# Local Parquet lake: write parsed rows to it, or upload from it instead of the CSVs
+LAKE_INGEST = os.getenv("LAKE_INGEST", "false").lower() == "true"
+LAKE_SOURCE = os.getenv("LAKE_SOURCE", "false").lower() == "true"
+LAKE_PARTITION_BY_CURRENCY = os.getenv("LAKE_PARTITION_BY_CURRENCY", "false").lower() == "true"
+# created_at days (YYYY-MM-DD, inclusive) read from the lake; empty = all
+LAKE_FROM = os.getenv("LAKE_FROM", "")
+LAKE_TO = os.getenv("LAKE_TO", "")
+
+# Bounded-memory mode: stream record batches into rolling Parquet staging files
+STREAMING_INGEST = os.getenv("STREAMING_INGEST", "false").lower() == "true"
+STAGING_DIR = PARQUET_DIR / "staging"
+STAGING_FILE_ROWS = int(os.getenv("STAGING_FILE_ROWS", "1000000"))
+
+# "truncate" reloads the whole table, "partition" rewrites it one created_at day at a time
+BQ_WRITE_MODE = os.getenv("BQ_WRITE_MODE", "truncate")
+BQ_LOAD_PARALLELISM = int(os.getenv("BQ_LOAD_PARALLELISM", "4"))
+
 # Full table path
 BQ_TABLE = f"{PROJECT_ID}.{DATASET_ID}.{TABLE_ID}"
 
-# BigQuery schema
-BIGQUERY_SCHEMA = [
-    bigquery.SchemaField("unique_id", "STRING"),
-    bigquery.SchemaField("refund_id", "INTEGER"),
-    bigquery.SchemaField("event_type", "STRING"),
-    bigquery.SchemaField("created_at", "TIMESTAMP"),
-    bigquery.SchemaField("integration", "INTEGER"),
-    bigquery.SchemaField("business_name", "STRING"),
-    bigquery.SchemaField("status", "STRING"),
-    bigquery.SchemaField("domain", "STRING"),
-    bigquery.SchemaField("currency", "STRING"),
-    bigquery.SchemaField("transaction", "INTEGER"),
-    bigquery.SchemaField("dispute", "INTEGER"),
-    bigquery.SchemaField("channel", "STRING"),
-    bigquery.SchemaField("fully_deducted", "BOOLEAN"),
-    bigquery.SchemaField("refunded_by", "STRING"),
-    bigquery.SchemaField("refunded_at", "TIMESTAMP"),
-    bigquery.SchemaField("expected_at", "TIMESTAMP"),
-    bigquery.SchemaField("deducted_amount", "NUMERIC"),
-    bigquery.SchemaField("amount", "NUMERIC"),
-    bigquery.SchemaField("customer_note", "STRING"),
-    bigquery.SchemaField("merchant_note", "STRING"),
-    bigquery.SchemaField("transaction_reference", "STRING"),
-    bigquery.SchemaField("settlement_date", "DATE"),
-    bigquery.SchemaField("settled", "BOOLEAN"),
-    bigquery.SchemaField("customer_id", "INTEGER"),
-    bigquery.SchemaField("customer_email", "STRING"),
-    bigquery.SchemaField("customer_phone", "STRING"),
-    bigquery.SchemaField("customer_first_name", "STRING"),
-    bigquery.SchemaField("customer_last_name", "STRING"),
-    bigquery.SchemaField("customer_code", "STRING"),
-    bigquery.SchemaField("merge_timestamp", "DATE"),
-]
-
-# Mapping from BigQuery type → pandas dtype
-BQ_TO_PD_DTYPES = {
-    "STRING": "string",
-    "INTEGER": "Int64",
-    "NUMERIC": "float64",
-    "BOOLEAN": "boolean",
-    "DATE": "string",
-    "TIMESTAMP": "datetime64[ns]",
-}
-
-
-def enforce_schema(df: pd.DataFrame) -> pd.DataFrame:
-    """Ensure dataframe matches the BigQuery schema exactly"""
-    df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_')
-    for field in BIGQUERY_SCHEMA:
-        col, bq_type = field.name, field.field_type
-        if col not in df.columns:
-            df[col] = pd.NA
-        try:
-            if bq_type == "TIMESTAMP":
-                df[col] = pd.to_datetime(df[col], errors="coerce")
-            elif bq_type == "DATE":
-                df[col] = pd.to_datetime(df[col], errors="coerce").dt.date
-            elif bq_type == "NUMERIC":
-                df[col] = df[col].astype("float64").astype(str).map(decimal.Decimal)
-            else:
-                df[col] = df[col].astype(BQ_TO_PD_DTYPES[bq_type], errors="ignore")
-        except Exception as e:
-            logging.error(f"Failed casting {col}: {e}")
-            df[col] = pd.NA
-    return df[[f.name for f in BIGQUERY_SCHEMA]]
-
 
-def load_csv_files(download_dir: str) -> pd.DataFrame:
-    """Read and merge all CSV files from downloads folder"""
+def load_csv_files(download_dir: str, engine: str = CSV_ENGINE, workers: int = PARSE_WORKERS) -> pa.Table:
+    """Read and merge all CSV files from downloads folder into one schema-typed Arrow table"""
+    if engine not in CSV_ENGINES:
+        raise ValueError(f"Unknown CSV engine {engine!r}, expected one of {CSV_ENGINES}")
     csv_files = glob.glob(os.path.join(download_dir, "*.csv"))
     if not csv_files:
         logging.error("No CSV files found in downloads/")
         return None
 
     logging.info(f"Found {len(csv_files)} CSV files")
-    df_list = []
-    for f in csv_files:
-        try:
-            logging.info(f"Reading {f}")
-            df = pd.read_csv(f)
-            df = enforce_schema(df)
-            df_list.append(df)
-        except Exception as e:
-            logging.error(f"Failed to process {f}: {e}")
-            continue
-
-    if not df_list:
+    cache = ParquetCache(max_bytes=PARQUET_CACHE_MAX_MB * 1024**2) if PARQUET_CACHE_MAX_MB else None
+    if workers > 1:
+        tables = parse_files_parallel(csv_files, engine, workers, PARSE_MAX_PENDING, cache)
+    else:
+        tables = []
+        for f in csv_files:
+            try:
+                logging.info(f"Reading {f}")
+                tables.append(parse_file_cached(f, engine, cache))
+            except Exception as e:
+                logging.error(f"Failed to process {f}: {e}")
+                continue
+    if cache:
+        cache.evict()
+
+    if not tables:
         return None
-    return pd.concat(df_list, ignore_index=True)
+    return pa.concat_tables(tables)
 
 
-def upload_to_bigquery(df: pd.DataFrame, table: str):
-    """Upload dataframe to BigQuery"""
+def upload_to_bigquery(refunds: pa.Table, table: str, mode: str = BQ_WRITE_MODE):
+    """Upload refunds to BigQuery via a Parquet file"""
     client = bigquery.Client()
+    if mode == "partition":
+        load_partitions(client, refunds, table, max_parallel=BQ_LOAD_PARALLELISM)
+        return
 
-    job_config = bigquery.LoadJobConfig(
-        schema=BIGQUERY_SCHEMA,
-        write_disposition="WRITE_TRUNCATE",
-    )
+    logging.info(f"Uploading {refunds.num_rows} rows to {table} ...")
+    ensure_table(client, table)
+    rows = load_table(client, refunds, table, "refunds_full", "WRITE_TRUNCATE")
+    logging.info(f"Upload complete. {rows} rows loaded.")
+
+
+class StagingWriter:
+    """Rolling Parquet staging file that is loaded into BigQuery each time it fills up"""
+
+    def __init__(self, client: bigquery.Client, table: str, max_rows: int = STAGING_FILE_ROWS):
+        self.client = client
+        self.table = table
+        self.max_rows = max_rows
+        self.parts = 0
+        self.rows = 0
+        self.total_rows = 0
+        self.path = None
+        self.writer = None
+
+    def write(self, batch: pa.Table):
+        batch = to_parquet_schema(sort_for_clustering(batch))
+        if self.writer is None:
+            self.parts += 1
+            self.path = STAGING_DIR / f"refunds_{self.parts:05d}.parquet"
+            self.writer = open_parquet_writer(self.path)
+        self.writer.write_table(batch, row_group_size=PARQUET_ROW_GROUP_ROWS)
+        self.rows += batch.num_rows
+        self.total_rows += batch.num_rows
+        if self.rows >= self.max_rows:
+            self.flush()
+
+    def write_file(self, batches) -> int:
+        """
+        Stage all record batches of one CSV, or none of them: the batches are
+        spooled to a Parquet file of their own and only copied into the staging
+        file once the whole CSV has parsed. Returns the rows staged.
+        """
+        spool = STAGING_DIR / "spool.parquet"
+        try:
+            with open_parquet_writer(spool) as writer:
+                for batch in batches:
+                    writer.write_table(to_parquet_schema(batch))
+            rows = 0
+            for batch in pq.ParquetFile(spool).iter_batches():
+                self.write(pa.Table.from_batches([batch]))
+                rows += batch.num_rows
+            return rows
+        finally:
+            spool.unlink(missing_ok=True)
+
+    def flush(self):
+        """Close the current staging file and load it (the first load truncates)"""
+        if self.writer is None:
+            return
+        self.writer.close()
+        disposition = "WRITE_TRUNCATE" if self.parts == 1 else "WRITE_APPEND"
+        load_parquet(self.client, self.path, self.table, disposition)
+        self.writer, self.rows = None, 0
+
+
+def stream_upload(download_dir: str, table: str) -> int:
+    """
+    Load every CSV in download_dir with memory bounded by one record batch and
+    one staging file, regardless of how many files there are. Returns rows loaded.
+    """
+    csv_files = sorted(glob.glob(os.path.join(download_dir, "*.csv")))
+    if not csv_files:
+        logging.error("No CSV files found in downloads/")
+        return 0
+
+    client = bigquery.Client()
+    ensure_table(client, table)
+    staging = StagingWriter(client, table)
+    for f in csv_files:
+        logging.info(f"Streaming {f}")
+        try:
+            staging.write_file(iter_csv_batches(f))
+        except Exception as e:
+            logging.error(f"Failed to process {f}, none of its rows were staged: {e}")
+            continue
+    staging.flush()
 
-    logging.info(f"Uploading {len(df)} rows to {table} ...")
-    job = client.load_table_from_dataframe(df, table, job_config=job_config)
-    job.result()  # wait for job to complete
-    logging.info(f"Upload complete. {job.output_rows} rows loaded.")
+    logging.info(f"Streamed {staging.total_rows} rows from {len(csv_files)} files in {staging.parts} staging files")
+    return staging.total_rows
 
 
 def main():
-    df = load_csv_files(DOWNLOAD_DIR)
-    if df is None:
-        logging.error("No data to upload. Exiting.")
+    if STREAMING_INGEST:
+        # Staging files cut across created_at days, so partitions can't be rewritten one by one
+        if BQ_WRITE_MODE != "truncate":
+            logging.error(f"STREAMING_INGEST only supports BQ_WRITE_MODE=truncate, not {BQ_WRITE_MODE}. Exiting.")
+            return
+        if not stream_upload(DOWNLOAD_DIR, BQ_TABLE):
+            logging.error("No data to upload. Exiting.")
         return
 
-    upload_to_bigquery(df, BQ_TABLE)
+    if LAKE_SOURCE:
+        start = date.fromisoformat(LAKE_FROM) if LAKE_FROM else None
+        end = date.fromisoformat(LAKE_TO) if LAKE_TO else None
+        # Anything but a partition load would replace the whole table with just these days
+        if (start or end) and BQ_WRITE_MODE != "partition":
+            logging.error("LAKE_FROM/LAKE_TO need BQ_WRITE_MODE=partition. Exiting.")
+            return
+        if not LAKE_DIR.exists():
+            logging.error(f"No lake at {LAKE_DIR} (run once with LAKE_INGEST=true). No data to upload. Exiting.")
+            return
+        refunds = read_lake(start=start, end=end, by_currency=LAKE_PARTITION_BY_CURRENCY)
+        if refunds.num_rows == 0:
+            logging.error("No data to upload. Exiting.")
+            return
+    else:
+        refunds = load_csv_files(DOWNLOAD_DIR)
+        if refunds is None:
+            logging.error("No data to upload. Exiting.")
+            return
+        if LAKE_INGEST:
+            write_lake(refunds, by_currency=LAKE_PARTITION_BY_CURRENCY)
+
+    upload_to_bigquery(refunds, BQ_TABLE)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache of parsed refund files.
+
+Each CSV's schema-typed Arrow table is stored once as Parquet under
+<root>/<CACHE_VERSION>/<sha256 of the CSV>.<engine>.parquet, so files that never
+change are parsed once and afterwards read back as columnar data.
+CACHE_VERSION changes with BIGQUERY_SCHEMA (or its Arrow types) and with
+PARSER_VERSION, and entries written under any other version are dropped. The
+least recently used entries are evicted once the cache grows past max_bytes.
+"""
+
+import os
+import uuid
+import shutil
+import logging
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from refund_schema import SCHEMA_VERSION, PARSER_VERSION
+from download_manifest import file_sha256
+from bq_load import PARQUET_DIR
+
+PARQUET_CACHE_DIR = PARQUET_DIR / "cache"
+PARQUET_CACHE_COMPRESSION = "zstd"
+
+# Cached tables are only reused by the same schema and the same parser
+CACHE_VERSION = f"{SCHEMA_VERSION}-p{PARSER_VERSION}"
+
+
+class ParquetCache:
+    """(sha256 of a CSV, CSV engine) → its parsed table, for the current CACHE_VERSION"""
+
+    def __init__(self, root: Path = PARQUET_CACHE_DIR, max_bytes: int = 10 * 1024**3):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.dir = self.root / CACHE_VERSION
+        self.dir.mkdir(parents=True, exist_ok=True)
+        for stale in self.root.iterdir():
+            if stale.is_dir() and stale.name != CACHE_VERSION:
+                logging.info(f"Dropping Parquet cache for old schema or parser version {stale.name}")
+                shutil.rmtree(stale, ignore_errors=True)
+
+    def path(self, sha256: str, engine: str) -> Path:
+        return self.dir / f"{sha256}.{engine}.parquet"
+
+    def get(self, sha256: str, engine: str):
+        """Cached table for sha256 as parsed by engine, or None"""
+        path = self.path(sha256, engine)
+        try:
+            table = pq.read_table(path, memory_map=True)
+        except (FileNotFoundError, pa.ArrowInvalid):
+            return None
+        # mtime is the last use, for LRU eviction
+        os.utime(path)
+        return table
+
+    def put(self, sha256: str, engine: str, table: pa.Table) -> Path:
+        """Store table for sha256 and engine; written to a temp file and renamed, so readers never see a partial entry"""
+        path = self.path(sha256, engine)
+        tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        pq.write_table(table, tmp, compression=PARQUET_CACHE_COMPRESSION)
+        os.replace(tmp, path)
+        return path
+
+    def load(self, csv_path, engine: str, parse, sha256: str = None) -> pa.Table:
+        """Table for csv_path from the cache, or parse(csv_path) with engine and cache the result"""
+        sha256 = sha256 or file_sha256(csv_path)
+        table = self.get(sha256, engine)
+        if table is not None:
+            logging.info(f"Parquet cache hit for {csv_path}")
+            return table
+        table = parse(csv_path)
+        self.put(sha256, engine, table)
+        return table
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        for path in self.dir.glob("*.parquet"):
+            try:
+                st = path.stat()
+            except FileNotFoundError:  # evicted by another process meanwhile
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            logging.info(f"Evicted {path.name} from the Parquet cache")
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Staged producer/consumer pipeline.
+
+Each stage runs in its own thread and hands results to the next stage through
+a bounded queue, so a slow stage applies backpressure instead of letting work
+pile up in memory. With stages download → parse → upload, file N+1 downloads
+while file N parses and file N-1 uploads, and wall time approaches the slowest
+stage rather than the sum of all three.
+"""
+
+import time
+import queue
+import logging
+import threading
+
+_DONE = object()
+
+
+def run_pipeline(items, stages, queue_size=2):
+    """
+    Push (label, payload) items through stages, a list of (name, fn).
+    Each fn takes the previous stage's payload and returns the next one;
+    returning None drops the item. A stage that raises logs the error and
+    drops the item. Returns {stage name: (items processed, busy seconds)}.
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    stats = {name: [0, 0.0] for name, _ in stages}
+
+    def worker(index, name, fn):
+        inbox = queues[index]
+        outbox = queues[index + 1] if index + 1 < len(stages) else None
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                break
+            label, payload = item
+            start = time.monotonic()
+            try:
+                result = fn(payload)
+            except Exception as e:
+                logging.error(f"{name} failed for {label}: {e}")
+                result = None
+            stats[name][0] += 1
+            stats[name][1] += time.monotonic() - start
+            if outbox is not None and result is not None:
+                outbox.put((label, result))
+        if outbox is not None:
+            outbox.put(_DONE)
+
+    threads = [
+        threading.Thread(target=worker, args=(i, name, fn), name=f"pipeline-{name}", daemon=True)
+        for i, (name, fn) in enumerate(stages)
+    ]
+    start = time.monotonic()
+    for t in threads:
+        t.start()
+    for item in items:
+        queues[0].put(item)
+    queues[0].put(_DONE)
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - start
+
+    for name, (count, busy) in stats.items():
+        logging.info(f"Stage {name}: {count} items, {busy:.1f}s busy ({busy / max(count, 1):.2f}s/item)")
+    logging.info(f"Pipeline finished in {elapsed:.1f}s wall time")
+    return {name: tuple(s) for name, s in stats.items()}
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Readers for refund CSVs.
+
+Column types come from the compiled schema in refund_schema, so with the
+pyarrow engine parsing and typing happen in one multithreaded native pass
+instead of pd.read_csv inference followed by a per-column recast.
+"""
+
+import csv
+import logging
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+from refund_schema import (
+    ARROW_SCHEMA,
+    SCHEMA_TYPES,
+    DICTIONARY_COLUMNS,
+    TRUE_VALUES,
+    FALSE_VALUES,
+    enforce_schema,
+    enforce_schema_arrow,
+    resolve_header,
+)
+
+# CSV_ENGINE values understood by the loaders
+CSV_ENGINES = ("pandas", "pyarrow")
+
+# Bytes of CSV text per record batch in streaming reads
+CSV_BLOCK_SIZE = 8 * 1024 * 1024
+
+# Arrow matches boolean spellings exactly, so list the usual casings of the schema's
+_ARROW_TRUE_VALUES = sorted({v for t in TRUE_VALUES for v in (t, t.capitalize(), t.upper())})
+_ARROW_FALSE_VALUES = sorted({v for f in FALSE_VALUES for v in (f, f.capitalize(), f.upper())})
+
+
+def read_header(path):
+    """Return the raw column names from the first line of a CSV"""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return next(csv.reader(f), [])
+
+
+def read_dtypes(raw_columns):
+    """
+    pd.read_csv dtype map: NUMERIC, INTEGER and BOOLEAN columns stay text so
+    refund_schema parses them cell by cell (a blank cell would otherwise turn
+    an integer or 1/0 column into floats), STRING columns are read straight
+    into Arrow-backed strings and dictionary columns into categories, so none
+    of them is ever an object column.
+    """
+    dtypes = {}
+    for raw, name in resolve_header(raw_columns).rename.items():
+        if name in DICTIONARY_COLUMNS:
+            dtypes[raw] = "category"
+        elif SCHEMA_TYPES.get(name) in ("NUMERIC", "STRING", "INTEGER", "BOOLEAN"):
+            dtypes[raw] = "string[pyarrow]"
+    return dtypes
+
+
+def read_csv_pandas(path) -> pd.DataFrame:
+    """pd.read_csv of the schema's columns only, with the column dtypes from read_dtypes()"""
+    header = read_header(path)
+    return pd.read_csv(path, usecols=resolve_header(header).usecols, dtype=read_dtypes(header))
+
+
+def read_csv_arrow(path) -> pa.Table:
+    """
+    Read a CSV into an Arrow table typed and ordered by the refunds schema.
+    Raises pyarrow.ArrowInvalid if a value cannot be converted to its schema type.
+    """
+    mapping = resolve_header(read_header(path))
+    # Timestamps are read as text: Arrow's CSV reader takes either zone-suffixed or
+    # bare values per type, and enforce_schema_arrow() accepts both
+    column_types = {
+        raw: pa.string() if pa.types.is_timestamp(ARROW_SCHEMA.field(name).type) else ARROW_SCHEMA.field(name).type
+        for raw, name in mapping.rename.items()
+    }
+
+    table = pacsv.read_csv(
+        path,
+        read_options=pacsv.ReadOptions(use_threads=True),
+        convert_options=pacsv.ConvertOptions(
+            column_types=column_types,
+            include_columns=mapping.usecols,
+            strings_can_be_null=True,
+            true_values=_ARROW_TRUE_VALUES,
+            false_values=_ARROW_FALSE_VALUES,
+        ),
+    )
+    return enforce_schema_arrow(table)
+
+
+def iter_csv_batches(path, block_size=CSV_BLOCK_SIZE):
+    """
+    Yield schema-typed Arrow tables of roughly block_size bytes of CSV each, so
+    memory stays bounded by the block size rather than the file size.
+    Schema columns are read as text and cast per batch. A batch that Arrow
+    can't cast goes through the pandas enforce_schema() instead.
+    """
+    raw_columns = resolve_header(read_header(path)).usecols
+    reader = pacsv.open_csv(
+        path,
+        read_options=pacsv.ReadOptions(use_threads=True, block_size=block_size),
+        convert_options=pacsv.ConvertOptions(
+            column_types={raw: pa.string() for raw in raw_columns},
+            include_columns=raw_columns,
+            strings_can_be_null=True,
+        ),
+    )
+    for batch in reader:
+        table = pa.Table.from_batches([batch])
+        try:
+            yield enforce_schema_arrow(table)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+            logging.warning(f"Arrow cast failed for a batch of {path} ({e}), falling back to pandas")
+            df = enforce_schema(table.to_pandas())
+            yield pa.Table.from_pandas(df, schema=ARROW_SCHEMA, preserve_index=False)
+
+
+def parse_file(path, engine) -> pa.Table:
+    """Parse one CSV into a schema-typed Arrow table, falling back to pandas if pyarrow can't type it"""
+    if engine == "pyarrow":
+        try:
+            return read_csv_arrow(path)
+        except pa.ArrowInvalid as e:
+            logging.warning(f"pyarrow could not type {path} ({e}), falling back to pandas")
+    df = enforce_schema(read_csv_pandas(path))
+    return pa.Table.from_pandas(df, schema=ARROW_SCHEMA, preserve_index=False)
+
+
+def parse_file_cached(path, engine, cache=None) -> pa.Table:
+    """parse_file() through a parquet_cache.ParquetCache, when one is given"""
+    if cache is None:
+        return parse_file(path, engine)
+    return cache.load(path, engine, lambda p: parse_file(p, engine))
+
+
+def _parse_to_ipc(path, engine, cache=None) -> pa.Buffer:
+    """Process-pool worker: parse a file and return it as an Arrow IPC stream buffer"""
+    table = parse_file_cached(path, engine, cache)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def parse_files_parallel(paths, engine, workers, max_pending=0, cache=None):
+    """
+    Parse files in a process pool and return their Arrow tables (in completion order).
+    Results come back as Arrow IPC buffers, which are read without copying.
+    At most max_pending files (default 2 × workers) are parsed or waiting to be
+    collected at once, which bounds peak memory. Workers read and fill cache
+    (a ParquetCache) if one is given.
+    """
+    max_pending = max_pending or 2 * workers
+    tables = []
+    todo = iter(paths)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        running = {}
+        while True:
+            while len(running) < max_pending:
+                path = next(todo, None)
+                if path is None:
+                    break
+                running[pool.submit(_parse_to_ipc, path, engine, cache)] = path
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = running.pop(future)
+                try:
+                    tables.append(pa.ipc.open_stream(future.result()).read_all())
+                    logging.info(f"Parsed {path}")
+                except Exception as e:
+                    logging.error(f"Failed to process {path}: {e}")
+    return tables
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Local Parquet lake of parsed refunds.
+
+Rows are stored as a hive-partitioned dataset under LAKE_DIR, one directory
+per created_at day (created_date=YYYY-MM-DD) and optionally per currency
+below that. Readers pass date/currency predicates down to the dataset, so only
+the matching partitions are opened instead of globbing and reparsing every CSV.
+"""
+
+import logging
+from datetime import date
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from refund_schema import ARROW_SCHEMA
+from bq_load import PARQUET_DIR, PARQUET_COMPRESSION, PARTITION_FIELD, decode_dictionary
+
+LAKE_DIR = PARQUET_DIR / "lake"
+
+# Hive partition column holding the UTC day of PARTITION_FIELD
+DATE_PARTITION = "created_date"
+
+
+def lake_partitioning(by_currency: bool = False) -> ds.Partitioning:
+    """created_date=YYYY-MM-DD[/currency=XXX] hive partitioning"""
+    fields = [pa.field(DATE_PARTITION, pa.date32())]
+    if by_currency:
+        fields.append(pa.field("currency", pa.string()))
+    return ds.partitioning(pa.schema(fields), flavor="hive")
+
+
+def write_lake(table: pa.Table, root=LAKE_DIR, by_currency: bool = False):
+    """
+    Write refunds into the lake. Every partition present in table is replaced
+    by exactly its rows; partitions table has no rows for are left alone.
+    """
+    days = pc.cast(table.column(PARTITION_FIELD), pa.date32())
+    table = table.append_column(DATE_PARTITION, days)
+    partitions = pc.count_distinct(days, mode="all").as_py()
+    if by_currency:
+        partitions *= max(pc.count_distinct(decode_dictionary(table.column("currency")), mode="all").as_py(), 1)
+    logging.info(f"Writing {table.num_rows} rows to {partitions} or fewer partitions of {root}")
+    ds.write_dataset(
+        table,
+        root,
+        format="parquet",
+        partitioning=lake_partitioning(by_currency),
+        existing_data_behavior="delete_matching",
+        basename_template="part-{i}.parquet",
+        file_options=ds.ParquetFileFormat().make_write_options(compression=PARQUET_COMPRESSION),
+        max_partitions=partitions + 1,
+    )
+
+
+def lake_filter(start: date = None, end: date = None, currencies=None):
+    """Dataset predicate for created_at days start..end (inclusive) and a set of currencies"""
+    predicate = None
+    for expr in (
+        ds.field(DATE_PARTITION) >= start if start else None,
+        ds.field(DATE_PARTITION) <= end if end else None,
+        ds.field("currency").isin(list(currencies)) if currencies else None,
+    ):
+        if expr is not None:
+            predicate = expr if predicate is None else predicate & expr
+    return predicate
+
+
+def read_lake(
+    root=LAKE_DIR, start: date = None, end: date = None, currencies=None, by_currency: bool = False, columns=None
+) -> pa.Table:
+    """
+    Read refunds from the lake, opening only partitions that can match the
+    predicate. Returns a table in ARROW_SCHEMA, or just columns if given.
+    """
+    dataset = ds.dataset(root, format="parquet", partitioning=lake_partitioning(by_currency))
+    table = dataset.to_table(columns=columns, filter=lake_filter(start, end, currencies))
+    logging.info(f"Read {table.num_rows} rows from {root}")
+    if columns:
+        return table
+    return table.select(ARROW_SCHEMA.names).cast(ARROW_SCHEMA)
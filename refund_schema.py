@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+BigQuery schema for the Paystack refunds table, shared by every script.
+
+The schema is compiled once at import into an Arrow schema, a pandas dtype map
+and a cast plan (one cast function per column), so loaders don't re-walk the
+field list with string comparisons for each file.
+"""
+
+import hashlib
+import logging
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from google.cloud import bigquery
+
+# BigQuery schema
+BIGQUERY_SCHEMA = [
+    bigquery.SchemaField("unique_id", "STRING"),
+    bigquery.SchemaField("refund_id", "INTEGER"),
+    bigquery.SchemaField("event_type", "STRING"),
+    bigquery.SchemaField("created_at", "TIMESTAMP"),
+    bigquery.SchemaField("integration", "INTEGER"),
+    bigquery.SchemaField("business_name", "STRING"),
+    bigquery.SchemaField("status", "STRING"),
+    bigquery.SchemaField("domain", "STRING"),
+    bigquery.SchemaField("currency", "STRING"),
+    bigquery.SchemaField("transaction", "INTEGER"),
+    bigquery.SchemaField("dispute", "INTEGER"),
+    bigquery.SchemaField("channel", "STRING"),
+    bigquery.SchemaField("fully_deducted", "BOOLEAN"),
+    bigquery.SchemaField("refunded_by", "STRING"),
+    bigquery.SchemaField("refunded_at", "TIMESTAMP"),
+    bigquery.SchemaField("expected_at", "TIMESTAMP"),
+    bigquery.SchemaField("deducted_amount", "NUMERIC"),
+    bigquery.SchemaField("amount", "NUMERIC"),
+    bigquery.SchemaField("customer_note", "STRING"),
+    bigquery.SchemaField("merchant_note", "STRING"),
+    bigquery.SchemaField("transaction_reference", "STRING"),
+    bigquery.SchemaField("settlement_date", "DATE"),
+    bigquery.SchemaField("settled", "BOOLEAN"),
+    bigquery.SchemaField("customer_id", "INTEGER"),
+    bigquery.SchemaField("customer_email", "STRING"),
+    bigquery.SchemaField("customer_phone", "STRING"),
+    bigquery.SchemaField("customer_first_name", "STRING"),
+    bigquery.SchemaField("customer_last_name", "STRING"),
+    bigquery.SchemaField("customer_code", "STRING"),
+    bigquery.SchemaField("merge_timestamp", "DATE"),
+]
+
+# Low-cardinality STRING columns, kept dictionary-encoded from parse to Parquet
+# (Arrow dictionary<int32, string>, pandas category). BigQuery still sees STRING.
+DICTIONARY_COLUMNS = {
+    "event_type",
+    "business_name",
+    "status",
+    "domain",
+    "currency",
+    "channel",
+    "refunded_by",
+}
+
+# BigQuery NUMERIC: 38 digits of precision, 9 after the decimal point
+NUMERIC_TYPE = pa.decimal128(38, 9)
+
+# Arrow type of DICTIONARY_COLUMNS
+DICTIONARY_TYPE = pa.dictionary(pa.int32(), pa.string())
+
+# Layouts of TIMESTAMP values in Paystack refund exports, tried in order before
+# falling back to per-value inference. A trailing Z is dropped before parsing:
+# values without an offset are UTC, values with one are converted to UTC.
+# strptime layouts are parsed natively by Arrow; "ISO8601" (pandas) also
+# covers fractional seconds, which Arrow's strptime can't read.
+TIMESTAMP_FORMATS = (
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S%z",
+    "%Y-%m-%d %H:%M:%S%z",
+    "ISO8601",
+)
+
+# DATE values are usually bare days, but some exports write them as timestamps
+DATE_FORMATS = ("%Y-%m-%d", *TIMESTAMP_FORMATS)
+
+# Spellings accepted for BOOLEAN cells (compared trimmed and lowercased)
+TRUE_VALUES = ("true", "1", "yes")
+FALSE_VALUES = ("false", "0", "no")
+
+# INTEGER cells: optional sign, up to 18 digits (always fits int64), optional ".0" from float exports
+INTEGER_PATTERN = r"^[+-]?\d{1,18}(\.0*)?$"
+
+# NUMERIC cells: optional sign, up to 29 integer digits and 9 significant decimals (decimal128(38, 9))
+NUMERIC_PATTERN = r"^[+-]?(\d{1,29}(\.\d{0,9}0*)?|\.\d{1,9}0*)$"
+
+# Values tried against a format before the whole column is, so formats a file doesn't use are skipped
+TIMESTAMP_SAMPLE_SIZE = 32
+
+# Mapping from BigQuery type → pandas dtype. Strings are Arrow-backed, so a
+# column is one Arrow buffer rather than one Python object per cell.
+BQ_TO_PD_DTYPES = {
+    "STRING": "string[pyarrow]",
+    "INTEGER": "Int64",
+    "NUMERIC": "decimal128(38, 9)[pyarrow]",
+    "BOOLEAN": "boolean",
+    "DATE": "date32[pyarrow]",
+    "TIMESTAMP": "datetime64[ns]",
+}
+
+# Mapping from BigQuery type → Arrow type
+BQ_TO_ARROW_TYPES = {
+    "STRING": pa.string(),
+    "INTEGER": pa.int64(),
+    "NUMERIC": NUMERIC_TYPE,
+    "BOOLEAN": pa.bool_(),
+    "DATE": pa.date32(),
+    "TIMESTAMP": pa.timestamp("ns"),
+}
+
+# Arrow → pandas dtypes used when a caller needs a DataFrame
+_ARROW_TO_PD_DTYPES = {
+    pa.string(): pd.StringDtype("pyarrow"),
+    pa.int64(): pd.Int64Dtype(),
+    pa.bool_(): pd.BooleanDtype(),
+    NUMERIC_TYPE: pd.ArrowDtype(NUMERIC_TYPE),
+    pa.date32(): pd.ArrowDtype(pa.date32()),
+}
+
+
+def normalize_column(name: str) -> str:
+    """Header normalization applied to every source column"""
+    return name.strip().lower().replace(" ", "_")
+
+
+class HeaderMapping(NamedTuple):
+    """How one CSV header layout maps onto the schema"""
+
+    fingerprint: str
+    rename: dict  # raw column → schema column
+    source: dict  # schema column → raw column
+    usecols: list  # raw columns that map to the schema, in file order (the read projection)
+    missing: list  # schema columns the header lacks
+    unexpected: list  # raw columns matching no schema column, or repeating one
+
+
+# fingerprint → HeaderMapping of every header layout this process has seen
+_HEADER_MAPPINGS = {}
+
+
+def header_fingerprint(raw_columns) -> str:
+    """Short hash identifying a raw header layout"""
+    return hashlib.sha1("\x1f".join(raw_columns).encode()).hexdigest()[:16]
+
+
+def resolve_header(raw_columns) -> HeaderMapping:
+    """
+    Map a raw header onto the schema, cached by the header's fingerprint so
+    files sharing a layout skip normalization and lookups entirely. A new
+    layout with missing or unexpected columns is logged once as schema drift.
+    """
+    raw_columns = [str(c) for c in raw_columns]
+    fingerprint = header_fingerprint(raw_columns)
+    mapping = _HEADER_MAPPINGS.get(fingerprint)
+    if mapping is not None:
+        return mapping
+
+    source, unexpected = {}, []
+    for raw in raw_columns:
+        name = normalize_column(raw)
+        if name in SCHEMA_TYPES and name not in source:
+            source[name] = raw
+        else:
+            unexpected.append(raw)
+    missing = [c for c in SCHEMA_COLUMNS if c not in source]
+    if missing or unexpected:
+        logging.warning(f"Schema drift in header {fingerprint}: missing {missing}, unexpected {unexpected}")
+
+    rename = {raw: name for name, raw in source.items()}
+    mapping = HeaderMapping(fingerprint, rename, source, list(rename), missing, unexpected)
+    _HEADER_MAPPINGS[fingerprint] = mapping
+    # Readers hand on only the usecols projection; register it too so its drift isn't reported twice
+    projected = header_fingerprint(mapping.usecols)
+    _HEADER_MAPPINGS.setdefault(projected, mapping._replace(fingerprint=projected, unexpected=[]))
+    return mapping
+
+
+def to_decimal(series: pd.Series) -> pd.Series:
+    """
+    Cast a column to BigQuery NUMERIC as an Arrow decimal128(38, 9) array.
+    Text is parsed exactly; no Python object is created per row. Cells that
+    aren't a number in range become null and are counted.
+    """
+    if isinstance(series.dtype, pd.ArrowDtype) and series.dtype.pyarrow_dtype == NUMERIC_TYPE:
+        return series
+    text = _as_text(series)
+    valid = pc.match_substring_regex(text, NUMERIC_PATTERN)
+    result = pc.cast(pc.if_else(valid, text, None), NUMERIC_TYPE)
+    _report_rejects(series, text, result, "NUMERIC")
+    return pd.Series(pd.arrays.ArrowExtensionArray(result), index=series.index, name=series.name)
+
+
+def _parse_format(values: pd.Series, fmt: str) -> pd.Series:
+    """Parse text values with one TIMESTAMP_FORMATS entry to UTC; NaT where they don't match"""
+    if fmt == "ISO8601":
+        return pd.to_datetime(values, format=fmt, errors="coerce", utc=True)
+    arr = pc.strptime(pa.array(values, from_pandas=True), format=fmt, unit="ns", error_is_null=True)
+    if arr.type.tz is None:
+        arr = arr.cast(pa.timestamp("ns", tz="UTC"))
+    return arr.to_pandas().set_axis(values.index)
+
+
+def parse_timestamps(series: pd.Series, formats=TIMESTAMP_FORMATS) -> pd.Series:
+    """
+    Parse a text column to naive-UTC datetime64[ns] with the fixed formats.
+    Each distinct value is parsed once and the result broadcast back to its rows.
+    Values no format matches go through slow per-value inference; those rows
+    are counted and logged.
+    """
+    if isinstance(series.dtype, pd.DatetimeTZDtype):
+        return series.dt.tz_convert(None).dt.as_unit("ns")
+    if pd.api.types.is_datetime64_dtype(series):
+        return series.dt.as_unit("ns")
+
+    codes, uniques = pd.factorize(series)
+    values = pd.Series(uniques, dtype="string[pyarrow]").str.strip().str.removesuffix("Z")
+    parsed = pd.Series(pd.NaT, index=values.index, dtype="datetime64[ns, UTC]")
+    todo = values.notna() & (values != "")
+    for fmt in formats:
+        if not todo.any():
+            break
+        remaining = values[todo]
+        if _parse_format(remaining.head(TIMESTAMP_SAMPLE_SIZE), fmt).isna().all():
+            continue
+        parsed = parsed.fillna(_parse_format(remaining, fmt))
+        todo &= parsed.isna()
+
+    if todo.any():
+        parsed = parsed.fillna(pd.to_datetime(values[todo], format="mixed", errors="coerce", utc=True))
+        slow_rows = int(np.isin(codes, np.flatnonzero(todo)).sum())
+        failed_rows = int(np.isin(codes, np.flatnonzero(todo & parsed.isna())).sum())
+        logging.warning(
+            f"{series.name}: {slow_rows} values matched no known timestamp format and were parsed "
+            f"one by one ({failed_rows} could not be parsed)"
+        )
+
+    result = parsed.dt.tz_convert(None).dt.as_unit("ns").array.take(codes, allow_fill=True)
+    return pd.Series(result, index=series.index, name=series.name)
+
+
+def parse_dates(series: pd.Series) -> pd.Series:
+    """Parse a text column to an Arrow date32 column (UTC day); no datetime.date objects are built"""
+    if isinstance(series.dtype, pd.ArrowDtype) and series.dtype.pyarrow_dtype == pa.date32():
+        return series
+    days = pa.array(parse_timestamps(series, DATE_FORMATS), from_pandas=True).cast(pa.date32())
+    return pd.Series(pd.arrays.ArrowExtensionArray(days), index=series.index, name=series.name)
+
+
+def _as_text(series: pd.Series) -> pa.Array:
+    """A column as a trimmed Arrow string array, for vectorized validation"""
+    return pc.utf8_trim_whitespace(pa.array(series.astype("string[pyarrow]"), from_pandas=True))
+
+
+def _report_rejects(series: pd.Series, text: pa.Array, result: pa.Array, bq_type: str):
+    """Log how many non-empty cells of series could not be read as bq_type (they are left null)"""
+    rejected = pc.and_(pc.and_(pc.is_valid(text), pc.not_equal(text, "")), pc.is_null(result))
+    count = pc.sum(rejected).as_py() or 0
+    if count:
+        logging.warning(f"{series.name}: {count} values rejected as {bq_type} and set to null")
+
+
+def parse_integers(series: pd.Series) -> pd.Series:
+    """Cast a column to nullable Int64 cell by cell: anything not an integer becomes null and is counted"""
+    if pd.api.types.is_integer_dtype(series):
+        return series.astype("Int64")
+    text = _as_text(series)
+    valid = pc.match_substring_regex(text, INTEGER_PATTERN)
+    # Arrow's int64 cast reads neither a leading + nor a ".0" tail, so strip both
+    digits = pc.replace_substring_regex(text, r"^\+|\.0*$", "")
+    result = pc.cast(pc.if_else(valid, digits, None), pa.int64())
+    _report_rejects(series, text, result, "INTEGER")
+    return pd.Series(result.to_pandas(types_mapper=_ARROW_TO_PD_DTYPES.get).array, index=series.index, name=series.name)
+
+
+def parse_booleans(series: pd.Series) -> pd.Series:
+    """Cast a column to nullable boolean from TRUE_VALUES/FALSE_VALUES; other values become null and are counted"""
+    if pd.api.types.is_bool_dtype(series):
+        return series.astype("boolean")
+    text = pc.utf8_lower(_as_text(series))
+    # 1/0 that were read as numbers come through as 1.0/0.0 once a blank cell makes the column float
+    text = pc.replace_substring_regex(text, r"^([01])\.0*$", r"\1")
+    result = pc.if_else(
+        pc.is_in(text, value_set=pa.array(TRUE_VALUES)),
+        True,
+        pc.if_else(pc.is_in(text, value_set=pa.array(FALSE_VALUES)), False, None),
+    )
+    _report_rejects(series, text, result, "BOOLEAN")
+    return pd.Series(result.to_pandas(types_mapper=_ARROW_TO_PD_DTYPES.get).array, index=series.index, name=series.name)
+
+
+def _astype(dtype):
+    def cast(series: pd.Series) -> pd.Series:
+        return series.astype(dtype, errors="ignore")
+    return cast
+
+
+def _arrow_type(field: bigquery.SchemaField) -> pa.DataType:
+    if field.name in DICTIONARY_COLUMNS:
+        return DICTIONARY_TYPE
+    return BQ_TO_ARROW_TYPES[field.field_type]
+
+
+def _pd_dtype(field: bigquery.SchemaField):
+    if field.name in DICTIONARY_COLUMNS:
+        return "category"
+    return BQ_TO_PD_DTYPES[field.field_type]
+
+
+def _caster(field: bigquery.SchemaField):
+    """Return the cast function for one schema field"""
+    bq_type = field.field_type
+    if bq_type == "TIMESTAMP":
+        return parse_timestamps
+    if bq_type == "DATE":
+        return parse_dates
+    if bq_type == "NUMERIC":
+        return to_decimal
+    if bq_type == "INTEGER":
+        return parse_integers
+    if bq_type == "BOOLEAN":
+        return parse_booleans
+    return _astype(_pd_dtype(field))
+
+
+# -------------------
+# Compiled schema
+# -------------------
+SCHEMA_COLUMNS = [f.name for f in BIGQUERY_SCHEMA]
+SCHEMA_TYPES = {f.name: f.field_type for f in BIGQUERY_SCHEMA}
+ARROW_SCHEMA = pa.schema([(f.name, _arrow_type(f)) for f in BIGQUERY_SCHEMA])
+PD_DTYPES = {f.name: _pd_dtype(f) for f in BIGQUERY_SCHEMA}
+CAST_PLAN = [(f.name, _caster(f)) for f in BIGQUERY_SCHEMA]
+
+# Bump whenever parsing changes its output for the same CSV without changing the
+# schema (formats, coercion rules, rejects); together with SCHEMA_VERSION it keys cached parsed output
+PARSER_VERSION = 1
+
+# Changes whenever the schema or its Arrow types do
+SCHEMA_VERSION = hashlib.sha256(
+    "\n".join([*(repr(f.to_api_repr()) for f in BIGQUERY_SCHEMA), ARROW_SCHEMA.to_string()]).encode()
+).hexdigest()[:16]
+
+
+def enforce_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """Ensure dataframe matches the BigQuery schema exactly"""
+    mapping = resolve_header(df.columns)
+    df = df.rename(columns=mapping.rename)
+    for col in mapping.missing:
+        df[col] = pd.NA
+    for col, cast in CAST_PLAN:
+        try:
+            df[col] = cast(df[col])
+        except Exception as e:
+            logging.error(f"Failed casting {col}: {e}")
+            df[col] = pd.NA
+    return df[SCHEMA_COLUMNS]
+
+
+def timestamp_text_to_utc(column):
+    """
+    Cast ISO 8601 text to naive-UTC timestamp[ns]. Values with a zone (Z,
+    +02:00) are converted to UTC; a column without zones is taken as UTC.
+    Raises pyarrow.ArrowInvalid if the column mixes both or isn't ISO 8601.
+    """
+    try:
+        return pc.cast(column, pa.timestamp("ns", tz="UTC")).cast(pa.timestamp("ns"))
+    except pa.ArrowInvalid:
+        return pc.cast(column, pa.timestamp("ns"))
+
+
+def enforce_schema_arrow(table: pa.Table) -> pa.Table:
+    """
+    Arrow counterpart of enforce_schema: normalize headers, add missing columns
+    as nulls, order by the schema and cast in a single native pass (no GIL held).
+    TIMESTAMP columns read as text go through timestamp_text_to_utc().
+    Raises pyarrow.ArrowInvalid if a value cannot be cast.
+    """
+    source = resolve_header(table.column_names).source
+    columns = []
+    for field in ARROW_SCHEMA:
+        if field.name not in source:
+            columns.append(pa.nulls(table.num_rows, type=field.type))
+            continue
+        column = table.column(source[field.name])
+        if pa.types.is_timestamp(field.type) and pa.types.is_string(column.type):
+            column = timestamp_text_to_utc(column)
+        columns.append(column)
+    return pa.Table.from_arrays(columns, names=SCHEMA_COLUMNS).cast(ARROW_SCHEMA)
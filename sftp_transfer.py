@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Resumable SFTP downloads shared by the refund scripts.
+
+A file is fetched into '<name>.part' next to its destination and only renamed
+into place once the byte count matches the remote size. Before the first byte
+is written, the remote size and mtime are recorded in '<name>.part.meta', so a
+transfer interrupted in any way (including a hard kill) resumes from the
+partial file's size on the next run instead of starting again from zero.
+"""
+
+import os
+import csv
+import json
+import logging
+from pathlib import Path
+
+import pandas as pd
+
+from refund_csv import read_dtypes
+from refund_schema import resolve_header
+
+# Read size per request when copying remote → local
+CHUNK_SIZE = 1024 * 1024
+
+# Rows per DataFrame chunk when parsing straight off the SFTP stream
+STREAM_CHUNK_ROWS = 50_000
+
+
+def _is_current(local_path: Path, remote_size, remote_mtime):
+    """True when local_path matches the remote file's size and mtime"""
+    try:
+        st = local_path.stat()
+    except FileNotFoundError:
+        return False
+    return st.st_size == remote_size and int(st.st_mtime) == int(remote_mtime)
+
+
+def _read_part_meta(meta_path: Path):
+    """(size, mtime) of the remote file a .part was started from, or None"""
+    try:
+        meta = json.loads(meta_path.read_text())
+        return meta["size"], meta["mtime"]
+    except (FileNotFoundError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _write_part_meta(meta_path: Path, remote_size, remote_mtime):
+    """Record the remote file a .part belongs to; written via a temp file so it is never half-written"""
+    tmp_path = meta_path.with_name(meta_path.name + ".tmp")
+    tmp_path.write_text(json.dumps({"size": remote_size, "mtime": int(remote_mtime)}))
+    os.replace(tmp_path, meta_path)
+
+
+def resumable_download(sftp, remote_path, local_path: Path, attr=None):
+    """
+    Download remote_path to local_path, resuming a previous partial transfer.
+    attr is an optional SFTPAttributes for remote_path (saves a stat round-trip).
+    Returns local_path.
+    """
+    local_path = Path(local_path)
+    attr = attr or sftp.stat(remote_path)
+    remote_size, remote_mtime = attr.st_size, attr.st_mtime
+
+    if _is_current(local_path, remote_size, remote_mtime):
+        logging.info(f"Skipping {local_path.name}, already up to date")
+        return local_path
+
+    part_path = local_path.with_name(local_path.name + ".part")
+    meta_path = local_path.with_name(local_path.name + ".part.meta")
+    offset = 0
+    if part_path.exists():
+        part_size = part_path.stat().st_size
+        # The sidecar names the remote size and mtime the .part was started
+        # from, so a remote file that changed since then is fetched again from scratch.
+        if _read_part_meta(meta_path) == (remote_size, int(remote_mtime)) and part_size <= remote_size:
+            offset = part_size
+        else:
+            logging.info(f"Discarding stale partial download {part_path}")
+            part_path.unlink()
+    if not offset:
+        _write_part_meta(meta_path, remote_size, remote_mtime)
+
+    if offset:
+        logging.info(f"Resuming {remote_path} at byte {offset}/{remote_size} -> {local_path}")
+    else:
+        logging.info(f"Downloading {remote_path} -> {local_path}")
+
+    with sftp.open(remote_path, "rb") as remote, open(part_path, "ab") as local:
+        remote.seek(offset)
+        remote.prefetch(remote_size)
+        while True:
+            chunk = remote.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            local.write(chunk)
+
+    size = part_path.stat().st_size
+    if size != remote_size:
+        raise IOError(f"Incomplete download of {remote_path}: got {size} of {remote_size} bytes")
+
+    os.utime(part_path, (remote_mtime, remote_mtime))
+    os.replace(part_path, local_path)
+    meta_path.unlink(missing_ok=True)
+    logging.info(f"Downloaded {local_path.name} ({remote_size} bytes)")
+    return local_path
+
+
+def stream_remote_csv(sftp, remote_path, attr=None, chunksize=STREAM_CHUNK_ROWS):
+    """
+    Yield DataFrame chunks parsed directly from the remote file, without
+    writing it to disk. Reads are prefetched, so parsing of the first rows
+    overlaps the rest of the transfer. NUMERIC columns are kept as text for
+    exact decimal parsing.
+    """
+    attr = attr or sftp.stat(remote_path)
+    logging.info(f"Streaming {remote_path} ({attr.st_size} bytes)")
+    with sftp.open(remote_path, "rb") as remote:
+        remote.prefetch(attr.st_size)
+        header = next(csv.reader([remote.readline().decode("utf-8-sig")]), [])
+        with pd.read_csv(
+            remote,
+            header=None,
+            names=header,
+            usecols=resolve_header(header).usecols,
+            dtype=read_dtypes(header),
+            chunksize=chunksize,
+        ) as reader:
+            for chunk in reader:
+                yield chunk
@@ -0,0 +1,213 @@
+from types import SimpleNamespace
+from datetime import date, datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from google.api_core.exceptions import BadRequest, Conflict
+
+import bq_load
+from bq_load import (
+    CLUSTERING_FIELDS,
+    NULL_PARTITION,
+    build_merge_sql,
+    dedupe_on_key,
+    load_partitions,
+    merge_upsert,
+    partition_ids,
+    submit_once,
+)
+from refund_schema import ARROW_SCHEMA
+
+
+def test_dedupe_on_key_keeps_last_row_per_key():
+    table = pa.table({"unique_id": ["a", "a", "b", "a", "c"], "v": [0, 1, 2, 3, 4]})
+    rows = dedupe_on_key(table).to_pylist()
+    assert rows == [
+        {"unique_id": "b", "v": 2},
+        {"unique_id": "a", "v": 3},
+        {"unique_id": "c", "v": 4},
+    ]
+
+
+def test_dedupe_on_key_drops_rows_without_key():
+    table = pa.table({"unique_id": ["a", None, "a"], "v": [0, 1, 2]})
+    assert dedupe_on_key(table).to_pylist() == [{"unique_id": "a", "v": 2}]
+
+
+class FakeJob:
+    def __init__(self, error=None, output_rows=0):
+        self.error = error
+        self.output_rows = output_rows
+        self.num_dml_affected_rows = output_rows
+
+    def result(self):
+        if self.error:
+            raise self.error
+        return self
+
+
+class FakeClient:
+    """Stand-in for bigquery.Client recording what the loaders do"""
+
+    def __init__(self, query_error=None):
+        self.query_error = query_error
+        self.loaded = {}
+        self.queries = []
+        self.deleted = []
+
+    def create_table(self, table, exists_ok=False):
+        return SimpleNamespace(clustering_fields=CLUSTERING_FIELDS)
+
+    def load_table_from_file(self, f, destination, job_config=None, job_id=None):
+        self.loaded[destination] = pq.read_table(f)
+        return FakeJob(output_rows=self.loaded[destination].num_rows)
+
+    def query(self, sql, job_id=None):
+        self.queries.append(sql)
+        return FakeJob(error=self.query_error)
+
+    def delete_table(self, table, not_found_ok=False):
+        self.deleted.append(table)
+
+
+def refunds(*unique_ids, created_at=None):
+    """Refunds table with these unique_ids, numbered by refund_id, other columns null unless given"""
+    values = {"unique_id": pa.array(unique_ids), "refund_id": pa.array(range(len(unique_ids)), pa.int64())}
+    if created_at is not None:
+        values["created_at"] = pa.array(created_at, ARROW_SCHEMA.field("created_at").type)
+    columns = [values.get(f.name, pa.nulls(len(unique_ids), f.type)) for f in ARROW_SCHEMA]
+    return pa.Table.from_arrays(columns, schema=ARROW_SCHEMA)
+
+
+def test_build_merge_sql_updates_and_inserts_every_column():
+    sql = build_merge_sql("p.d.refunds", "p.d.staging", "unique_id", ["unique_id", "amount", "status"])
+    assert sql == (
+        "MERGE `p.d.refunds` T\n"
+        "USING `p.d.staging` S\n"
+        "ON T.`unique_id` = S.`unique_id`\n"
+        "WHEN MATCHED THEN UPDATE SET\n"
+        "    `amount` = S.`amount`,\n"
+        "    `status` = S.`status`\n"
+        "WHEN NOT MATCHED THEN INSERT (`unique_id`, `amount`, `status`)\n"
+        "VALUES (S.`unique_id`, S.`amount`, S.`status`)"
+    )
+
+
+def test_build_merge_sql_limits_target_to_partition_days():
+    sql = build_merge_sql("p.d.refunds", "p.d.staging", days=(date(2024, 5, 1), date(2024, 5, 3)))
+    assert (
+        "ON T.`unique_id` = S.`unique_id`\n"
+        "  AND T.`created_at` >= TIMESTAMP '2024-05-01' AND T.`created_at` < TIMESTAMP '2024-05-04'\n"
+    ) in sql
+
+
+def test_merge_upsert_prunes_dated_rows_and_merges_undated_rows_separately(tmp_path, monkeypatch):
+    monkeypatch.setattr(bq_load, "PARQUET_DIR", tmp_path)
+    client = FakeClient()
+    created_at = [datetime(2024, 5, 3, 23, 59), None, datetime(2024, 5, 1, 0, 0)]
+    merge_upsert(client, refunds("a", "b", "c", created_at=created_at), "p.d.refunds", "daily")
+
+    dated, undated = client.loaded
+    assert client.loaded[dated].column("unique_id").to_pylist() == ["a", "c"]
+    assert client.loaded[undated].column("unique_id").to_pylist() == ["b"]
+    assert "TIMESTAMP '2024-05-01' AND T.`created_at` < TIMESTAMP '2024-05-04'" in client.queries[0]
+    assert f"USING `{undated}` S\nON T.`unique_id` = S.`unique_id`\nWHEN" in client.queries[1]
+    assert client.deleted == [dated, undated]
+
+
+def test_merge_upsert_loads_deduplicated_rows_and_drops_staging(tmp_path, monkeypatch):
+    monkeypatch.setattr(bq_load, "PARQUET_DIR", tmp_path)
+    client = FakeClient()
+    merge_upsert(client, refunds("a", "b", "a"), "p.d.refunds", "daily")
+
+    (staging,) = client.loaded
+    assert staging.startswith("p.d.refunds_staging_")
+    assert client.loaded[staging].column("unique_id").to_pylist() == ["b", "a"]
+    assert client.loaded[staging].column("refund_id").to_pylist() == [1, 2]
+    assert f"USING `{staging}` S" in client.queries[0]
+    assert client.deleted == [staging]
+
+
+def test_merge_upsert_drops_staging_when_merge_fails(tmp_path, monkeypatch):
+    monkeypatch.setattr(bq_load, "PARQUET_DIR", tmp_path)
+    client = FakeClient(query_error=BadRequest("MERGE failed"))
+    with pytest.raises(BadRequest):
+        merge_upsert(client, refunds("a"), "p.d.refunds", "daily")
+
+    (staging,) = client.loaded
+    assert client.deleted == [staging]
+
+
+class PartitionedClient(FakeClient):
+    """FakeClient whose target table is day-partitioned on partition_field"""
+
+    def __init__(self, partition_field="created_at"):
+        super().__init__()
+        self.partition_field = partition_field
+
+    def get_table(self, table):
+        return SimpleNamespace(time_partitioning=SimpleNamespace(field=self.partition_field))
+
+
+def test_partition_ids_bucket_naive_timestamps_by_utc_day():
+    table = refunds("a", "b", "c", created_at=[datetime(2024, 5, 1, 23, 59, 59), datetime(2024, 5, 2), None])
+    assert partition_ids(table).to_pylist() == ["20240501", "20240502", NULL_PARTITION]
+
+
+def test_load_partitions_truncates_each_day_partition(tmp_path, monkeypatch):
+    monkeypatch.setattr(bq_load, "PARQUET_DIR", tmp_path)
+    client = PartitionedClient()
+    created_at = [datetime(2024, 5, 1, 10), None, datetime(2024, 5, 2, 1), datetime(2024, 5, 1, 23)]
+    load_partitions(client, refunds("a", "b", "c", "d", created_at=created_at), "p.d.refunds", max_parallel=2)
+
+    loaded = {dest: sorted(t.column("unique_id").to_pylist()) for dest, t in client.loaded.items()}
+    assert loaded == {
+        "p.d.refunds$20240501": ["a", "d"],
+        "p.d.refunds$20240502": ["c"],
+        f"p.d.refunds${NULL_PARTITION}": ["b"],
+    }
+
+
+def test_load_partitions_refuses_table_partitioned_on_another_field(tmp_path, monkeypatch):
+    monkeypatch.setattr(bq_load, "PARQUET_DIR", tmp_path)
+    client = PartitionedClient(partition_field="settlement_date")
+    with pytest.raises(ValueError, match="not day-partitioned on created_at"):
+        load_partitions(client, refunds("a", created_at=[datetime(2024, 5, 1)]), "p.d.refunds")
+    assert client.loaded == {}
+
+
+class JobsClient:
+    """Fake client where job IDs in existing already ran, with the given error (None = succeeded)"""
+
+    def __init__(self, existing):
+        self.existing = existing
+        self.submitted = []
+
+    def submit(self, job_id):
+        if job_id in self.existing:
+            raise Conflict(f"Already Exists: Job {job_id}")
+        self.submitted.append(job_id)
+        return FakeJob()
+
+    def get_job(self, job_id):
+        return FakeJob(error=self.existing[job_id])
+
+
+def test_submit_once_reuses_a_job_that_succeeded():
+    client = JobsClient({"refunds_x": None})
+    job = submit_once(client, "refunds_x", client.submit)
+    assert job.error is None
+    assert client.submitted == []
+
+
+def test_submit_once_retries_after_a_failed_job():
+    client = JobsClient({"refunds_x": BadRequest("load failed")})
+    submit_once(client, "refunds_x", client.submit)
+    assert client.submitted == ["refunds_x_1"]
+
+
+def test_submit_once_without_job_id_always_submits():
+    client = JobsClient({})
+    submit_once(client, None, client.submit)
+    assert client.submitted == [None]
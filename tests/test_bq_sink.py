@@ -0,0 +1,131 @@
+from types import SimpleNamespace
+from datetime import datetime
+
+import pyarrow as pa
+import pytest
+
+import bq_sink
+from bq_load import CLUSTERING_FIELDS
+from bq_sink import STORAGE_WRITE_SCHEMA, LoadJobSink, RefundSink, StorageWriteSink
+from refund_schema import ARROW_SCHEMA
+
+
+class FakeFuture:
+    def result(self):
+        return None
+
+
+class FakeAppendRowsStream:
+    """Stand-in for writer.AppendRowsStream recording every request sent"""
+
+    def __init__(self, client, template):
+        self.template = template
+        self.requests = client.requests
+        client.append_streams.append(self)
+        self.closed = False
+
+    def send(self, request):
+        self.requests.append(request)
+        return FakeFuture()
+
+    def close(self):
+        self.closed = True
+
+
+class FakeWriteClient:
+    """Stand-in for BigQueryWriteClient"""
+
+    def __init__(self):
+        self.requests = []
+        self.append_streams = []
+        self.finalized = []
+        self.commits = []
+
+    def table_path(self, project, dataset, table):
+        return f"projects/{project}/datasets/{dataset}/tables/{table}"
+
+    def create_write_stream(self, parent, write_stream):
+        return SimpleNamespace(name=f"{parent}/streams/s1", type_=write_stream.type_)
+
+    def finalize_write_stream(self, name):
+        self.finalized.append(name)
+
+    def batch_commit_write_streams(self, request):
+        self.commits.append(request)
+        return SimpleNamespace(stream_errors=[])
+
+
+class FakeBigQueryClient:
+    def create_table(self, table, exists_ok=False):
+        return SimpleNamespace(clustering_fields=CLUSTERING_FIELDS)
+
+
+@pytest.fixture
+def write_client(monkeypatch):
+    monkeypatch.setattr(bq_sink.writer, "AppendRowsStream", FakeAppendRowsStream)
+    return FakeWriteClient()
+
+
+def refunds(*unique_ids):
+    values = {
+        "unique_id": pa.array(unique_ids),
+        "currency": pa.array(["ZAR"] * len(unique_ids)).dictionary_encode().cast(ARROW_SCHEMA.field("currency").type),
+        "created_at": pa.array([datetime(2024, 5, 1)] * len(unique_ids), ARROW_SCHEMA.field("created_at").type),
+    }
+    columns = [values.get(f.name, pa.nulls(len(unique_ids), f.type)) for f in ARROW_SCHEMA]
+    return pa.Table.from_arrays(columns, schema=ARROW_SCHEMA)
+
+
+def sent_batch(request):
+    return pa.ipc.read_record_batch(request.arrow_rows.rows.serialized_record_batch, STORAGE_WRITE_SCHEMA)
+
+
+def test_refund_sink_is_abstract():
+    with pytest.raises(TypeError):
+        RefundSink()
+
+
+def test_load_job_sink_uploads_everything_once_on_close():
+    uploads = []
+    sink = LoadJobSink(uploads.append)
+    sink.write(refunds("a"))
+    sink.write(refunds("b", "c"))
+    assert uploads == []
+    assert sink.close() == 3
+    assert [t.column("unique_id").to_pylist() for t in uploads] == [["a", "b", "c"]]
+
+
+def test_committed_stream_offsets_and_decoded_dictionaries(write_client, monkeypatch):
+    monkeypatch.setattr(bq_sink, "STORAGE_WRITE_BATCH_ROWS", 2)
+    sink = StorageWriteSink("p.d.refunds", client=write_client, bq_client=FakeBigQueryClient())
+    sink.write(refunds("a", "b", "c"))
+    sink.write(refunds("d"))
+    assert sink.close() == 4
+
+    assert [r.offset for r in write_client.requests] == [0, 2, 3]
+    assert [r.arrow_rows.rows.row_count for r in write_client.requests] == [2, 1, 1]
+    batch = sent_batch(write_client.requests[0])
+    assert batch.schema.field("currency").type == pa.string()
+    assert batch.column("currency").to_pylist() == ["ZAR", "ZAR"]
+    (append_stream,) = write_client.append_streams
+    schema = pa.ipc.read_schema(pa.py_buffer(append_stream.template.arrow_rows.writer_schema.serialized_schema))
+    assert schema.equals(STORAGE_WRITE_SCHEMA)
+    assert append_stream.closed
+    assert write_client.finalized == ["projects/p/datasets/d/tables/refunds/streams/s1"]
+    assert write_client.commits == []
+
+
+def test_pending_stream_is_committed_on_close(write_client):
+    sink = StorageWriteSink("p.d.refunds", mode="pending", client=write_client, bq_client=FakeBigQueryClient())
+    sink.write(refunds("a"))
+    sink.close()
+
+    (commit,) = write_client.commits
+    assert commit.parent == "projects/p/datasets/d/tables/refunds"
+    assert list(commit.write_streams) == ["projects/p/datasets/d/tables/refunds/streams/s1"]
+
+
+def test_sink_without_rows_opens_no_stream(write_client):
+    sink = StorageWriteSink("p.d.refunds", client=write_client, bq_client=FakeBigQueryClient())
+    assert sink.close() == 0
+    assert write_client.append_streams == []
@@ -0,0 +1,58 @@
+from types import SimpleNamespace
+
+from download_manifest import DownloadManifest, file_sha256
+
+
+def remote(name, size, mtime=1_700_000_000):
+    return SimpleNamespace(filename=name, st_size=size, st_mtime=mtime)
+
+
+def test_pending_lists_new_changed_and_missing_files(tmp_path):
+    (tmp_path / "same.csv").write_bytes(b"abc")
+    (tmp_path / "changed.csv").write_bytes(b"abc")
+    with DownloadManifest(tmp_path) as manifest:
+        manifest.record(remote("same.csv", 3), tmp_path / "same.csv")
+        manifest.record(remote("changed.csv", 3), tmp_path / "changed.csv")
+        manifest.record(remote("deleted.csv", 3), tmp_path / "same.csv")
+
+        attrs = [
+            remote("same.csv", 3),
+            remote("changed.csv", 3, mtime=1_800_000_000),
+            remote("deleted.csv", 3),
+            remote("new.csv", 5),
+        ]
+        todo = manifest.pending(attrs)
+        assert [attr.filename for attr in todo] == ["changed.csv", "deleted.csv", "new.csv"]
+
+
+def test_record_stores_size_mtime_and_hash(tmp_path):
+    (tmp_path / "a.csv").write_bytes(b"abc")
+    with DownloadManifest(tmp_path) as manifest:
+        manifest.record(remote("a.csv", 3), tmp_path / "a.csv")
+        assert manifest.get("a.csv") == (3, 1_700_000_000, file_sha256(tmp_path / "a.csv"))
+
+
+def test_pending_adopts_local_files_that_predate_the_manifest(tmp_path):
+    (tmp_path / "old.csv").write_bytes(b"abc")
+    (tmp_path / "partial.csv").write_bytes(b"ab")
+    with DownloadManifest(tmp_path) as manifest:
+        todo = manifest.pending([remote("old.csv", 3), remote("partial.csv", 3)])
+        assert [attr.filename for attr in todo] == ["partial.csv"]
+        assert manifest.sha256("old.csv") == file_sha256(tmp_path / "old.csv")
+        assert manifest.pending([remote("old.csv", 3)]) == []
+
+
+def test_stage_is_invalidated_by_new_content(tmp_path):
+    path = tmp_path / "a.csv"
+    path.write_bytes(b"abc")
+    with DownloadManifest(tmp_path) as manifest:
+        manifest.record(remote("a.csv", 3), path)
+        manifest.mark("a.csv", "upload", job_id="job_1")
+        assert manifest.stage("a.csv", "upload") == (None, "job_1")
+
+        manifest.record(remote("a.csv", 3, mtime=1_800_000_000), path)
+        assert manifest.stage("a.csv", "upload") == (None, "job_1")
+
+        path.write_bytes(b"xyz")
+        manifest.record(remote("a.csv", 3, mtime=1_900_000_000), path)
+        assert manifest.stage("a.csv", "upload") is None
@@ -0,0 +1,38 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import initial_upload_to_bq
+from initial_upload_to_bq import StagingWriter
+from refund_schema import ARROW_SCHEMA
+
+
+def refunds(*unique_ids):
+    columns = [
+        pa.array(unique_ids) if f.name == "unique_id" else pa.nulls(len(unique_ids), f.type) for f in ARROW_SCHEMA
+    ]
+    return pa.Table.from_arrays(columns, schema=ARROW_SCHEMA)
+
+
+def test_file_failing_partway_stages_none_of_its_rows(tmp_path, monkeypatch):
+    loaded = []
+    monkeypatch.setattr(initial_upload_to_bq, "STAGING_DIR", tmp_path)
+    monkeypatch.setattr(
+        initial_upload_to_bq,
+        "load_parquet",
+        lambda client, path, table, disposition: loaded.extend(pq.read_table(path).column("unique_id").to_pylist()),
+    )
+
+    def broken_file():
+        yield refunds("b1", "b2")
+        raise pa.ArrowInvalid("bad row")
+
+    staging = StagingWriter(client=None, table="p.d.refunds")
+    assert staging.write_file(iter([refunds("a1"), refunds("a2")])) == 2
+    with pytest.raises(pa.ArrowInvalid):
+        staging.write_file(broken_file())
+    staging.write_file(iter([refunds("c1")]))
+    staging.flush()
+
+    assert loaded == ["a1", "a2", "c1"]
+    assert staging.total_rows == 3
@@ -0,0 +1,34 @@
+import pyarrow as pa
+
+import parquet_cache
+from parquet_cache import ParquetCache
+
+
+def counting_parse(calls):
+    def parse(path):
+        calls.append(path)
+        return pa.table({"unique_id": ["a"]})
+    return parse
+
+
+def test_entries_are_keyed_by_engine(tmp_path):
+    csv = tmp_path / "refunds.csv"
+    csv.write_text("unique_id\na\n")
+    cache, calls = ParquetCache(tmp_path / "cache"), []
+    cache.load(csv, "pandas", counting_parse(calls))
+    cache.load(csv, "pandas", counting_parse(calls))
+    cache.load(csv, "pyarrow", counting_parse(calls))
+    assert calls == [csv, csv]
+
+
+def test_parser_version_change_drops_entries(tmp_path, monkeypatch):
+    csv = tmp_path / "refunds.csv"
+    csv.write_text("unique_id\na\n")
+    calls = []
+    ParquetCache(tmp_path / "cache").load(csv, "pandas", counting_parse(calls))
+
+    monkeypatch.setattr(parquet_cache, "CACHE_VERSION", parquet_cache.CACHE_VERSION + "-next")
+    cache = ParquetCache(tmp_path / "cache")
+    cache.load(csv, "pandas", counting_parse(calls))
+    assert calls == [csv, csv]
+    assert [p.name for p in (tmp_path / "cache").iterdir()] == [cache.dir.name]
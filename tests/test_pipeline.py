@@ -0,0 +1,63 @@
+import time
+import threading
+
+from pipeline import run_pipeline
+
+
+def test_items_flow_through_stages_in_order():
+    out = []
+    stats = run_pipeline(
+        ((f"f{i}", i) for i in range(5)),
+        [("double", lambda x: x * 2), ("inc", lambda x: x + 1), ("collect", out.append)],
+    )
+    assert out == [1, 3, 5, 7, 9]
+    assert {name: count for name, (count, _) in stats.items()} == {"double": 5, "inc": 5, "collect": 5}
+
+
+def test_stage_error_drops_only_that_item():
+    out = []
+
+    def parse(x):
+        if x == 2:
+            raise ValueError("bad file")
+        return x
+
+    stats = run_pipeline(((f"f{i}", i) for i in range(4)), [("parse", parse), ("upload", out.append)])
+    assert out == [0, 1, 3]
+    assert stats["parse"][0] == 4
+    assert stats["upload"][0] == 3
+
+
+def test_bounded_queues_apply_backpressure():
+    produced, lock = [], threading.Lock()
+    consumed = []
+
+    def produce(x):
+        with lock:
+            produced.append(x)
+        return x
+
+    def slow_consume(x):
+        time.sleep(0.02)
+        with lock:
+            # download runs ahead by at most the queued item plus one in hand on each side
+            assert len(produced) - len(consumed) <= 3
+            consumed.append(x)
+
+    run_pipeline(((f"f{i}", i) for i in range(20)), [("download", produce), ("upload", slow_consume)], queue_size=1)
+    assert consumed == list(range(20))
+
+
+def test_stages_overlap_and_report_busy_time():
+    def slow(x):
+        time.sleep(0.05)
+        return x
+
+    start = time.monotonic()
+    stats = run_pipeline(((f"f{i}", i) for i in range(6)), [("a", slow), ("b", slow), ("c", slow)])
+    elapsed = time.monotonic() - start
+    for count, busy in stats.values():
+        assert count == 6
+        assert busy >= 0.25
+    # Serially this is 18 × 0.05s = 0.9s; overlapped it approaches 8 × 0.05s
+    assert elapsed < 0.75
@@ -0,0 +1,25 @@
+import logging
+
+from refund_csv import parse_file
+
+HEADER = "unique_id,created_at,refunded_at\n"
+
+
+def test_pyarrow_engine_reads_zone_suffixed_timestamps(tmp_path, caplog):
+    path = tmp_path / "refunds.csv"
+    path.write_text(HEADER + "a,2024-01-02T10:00:00Z,2024-01-02T12:30:00+02:00\nb,2024-01-03T00:00:00Z,\n")
+    with caplog.at_level(logging.WARNING):
+        table = parse_file(path, "pyarrow")
+    assert "falling back to pandas" not in caplog.text
+    assert table.equals(parse_file(path, "pandas"))
+    assert [str(t) for t in table.column("created_at").to_pylist()] == ["2024-01-02 10:00:00", "2024-01-03 00:00:00"]
+    assert str(table.column("refunded_at")[0].as_py()) == "2024-01-02 10:30:00"
+
+
+def test_pyarrow_engine_reads_bare_timestamps_as_utc(tmp_path, caplog):
+    path = tmp_path / "refunds.csv"
+    path.write_text(HEADER + "a,2024-01-02 10:00:00,\n")
+    with caplog.at_level(logging.WARNING):
+        table = parse_file(path, "pyarrow")
+    assert "falling back to pandas" not in caplog.text
+    assert table.equals(parse_file(path, "pandas"))
@@ -0,0 +1,60 @@
+from pathlib import Path
+from datetime import date, datetime
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from refund_lake import lake_filter, lake_partitioning, read_lake, write_lake
+from refund_schema import ARROW_SCHEMA
+
+
+def refunds(rows):
+    """Refunds table from (unique_id, created_at, currency) tuples, other columns null"""
+    unique_ids, created_at, currencies = zip(*rows)
+    values = {
+        "unique_id": pa.array(unique_ids),
+        "created_at": pa.array(created_at, ARROW_SCHEMA.field("created_at").type),
+        "currency": pa.array(currencies).dictionary_encode().cast(ARROW_SCHEMA.field("currency").type),
+    }
+    columns = [values.get(f.name, pa.nulls(len(rows), f.type)) for f in ARROW_SCHEMA]
+    return pa.Table.from_arrays(columns, schema=ARROW_SCHEMA)
+
+
+def unique_ids(table):
+    return sorted(table.column("unique_id").to_pylist())
+
+
+def test_rewrite_replaces_only_partitions_present(tmp_path):
+    write_lake(refunds([("a", datetime(2024, 5, 1, 9), "ZAR"), ("b", datetime(2024, 5, 2, 9), "ZAR")]), tmp_path)
+    write_lake(refunds([("a2", datetime(2024, 5, 1, 10), "ZAR")]), tmp_path)
+    assert unique_ids(read_lake(tmp_path)) == ["a2", "b"]
+
+
+def test_filters_select_days_and_currencies(tmp_path):
+    rows = [
+        ("a", datetime(2024, 5, 1, 9), "ZAR"),
+        ("b", datetime(2024, 5, 2, 9), "NGN"),
+        ("c", datetime(2024, 5, 2, 10), "ZAR"),
+        ("d", datetime(2024, 5, 3, 9), "ZAR"),
+    ]
+    write_lake(refunds(rows), tmp_path, by_currency=True)
+
+    table = read_lake(tmp_path, start=date(2024, 5, 2), end=date(2024, 5, 3), by_currency=True)
+    assert unique_ids(table) == ["b", "c", "d"]
+    assert table.schema == ARROW_SCHEMA
+    zar = read_lake(tmp_path, start=date(2024, 5, 2), currencies=["ZAR"], by_currency=True)
+    assert unique_ids(zar) == ["c", "d"]
+
+
+def test_filters_prune_partitions_before_reading(tmp_path):
+    rows = [
+        ("a", datetime(2024, 5, 1, 9), "ZAR"),
+        ("b", datetime(2024, 5, 2, 9), "NGN"),
+        ("c", datetime(2024, 5, 2, 9), "ZAR"),
+    ]
+    write_lake(refunds(rows), tmp_path, by_currency=True)
+    dataset = ds.dataset(tmp_path, format="parquet", partitioning=lake_partitioning(by_currency=True))
+    fragments = dataset.get_fragments(filter=lake_filter(start=date(2024, 5, 2), currencies=["ZAR"]))
+    assert [Path(f.path).relative_to(tmp_path).parent.as_posix() for f in fragments] == [
+        "created_date=2024-05-02/currency=ZAR"
+    ]
@@ -0,0 +1,32 @@
+from decimal import Decimal
+
+import pandas as pd
+
+from refund_csv import read_csv_pandas
+from refund_schema import enforce_schema, parse_booleans, parse_integers, to_decimal
+
+
+def test_parse_integers_accepts_sign_and_float_tail():
+    series = pd.Series(["+5", "-3", " 7.0", "x", None], name="refund_id")
+    assert parse_integers(series).tolist() == [5, -3, 7, pd.NA, pd.NA]
+
+
+def test_parse_booleans_accepts_numeric_one_and_zero():
+    series = pd.Series([1.0, 0.0, None], name="settled")
+    assert parse_booleans(series).tolist() == [True, False, pd.NA]
+
+
+def test_blank_cells_do_not_null_integer_or_boolean_columns(tmp_path):
+    path = tmp_path / "refunds.csv"
+    path.write_text("unique_id,refund_id,settled\na,+5,1\nb,6,\nc,,0\n")
+    df = enforce_schema(read_csv_pandas(path))
+    assert df["refund_id"].dtype == "Int64"
+    assert df["refund_id"].tolist() == [5, 6, pd.NA]
+    assert df["settled"].tolist() == [True, pd.NA, False]
+
+
+def test_to_decimal_nulls_only_bad_cells():
+    series = pd.Series(["10.50", "abc", "1.1234567891", " 2 ", None], name="amount", dtype="string[pyarrow]")
+    result = to_decimal(series)
+    assert str(result.dtype) == "decimal128(38, 9)[pyarrow]"
+    assert result.tolist() == [Decimal("10.5"), pd.NA, pd.NA, Decimal("2"), pd.NA]
@@ -0,0 +1,75 @@
+import io
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import sftp_transfer
+from sftp_transfer import resumable_download
+
+REMOTE_MTIME = 1_700_000_000
+
+
+class FakeRemoteFile(io.BytesIO):
+    """Remote file that dies (like a killed process) after fail_after bytes"""
+
+    def __init__(self, data, fail_after=None):
+        super().__init__(data)
+        self.fail_after = fail_after
+
+    def prefetch(self, size):
+        pass
+
+    def read(self, size=-1):
+        if self.fail_after is not None and self.tell() >= self.fail_after:
+            raise KeyboardInterrupt("killed")
+        return super().read(size)
+
+
+class FakeSFTP:
+    def __init__(self, data, fail_after=None):
+        self.data = data
+        self.fail_after = fail_after
+        self.offsets = []
+
+    def stat(self, path):
+        return SimpleNamespace(st_size=len(self.data), st_mtime=REMOTE_MTIME)
+
+    def open(self, path, mode):
+        remote = FakeRemoteFile(self.data, self.fail_after)
+        seek = remote.seek
+        remote.seek = lambda offset, *args: (self.offsets.append(offset), seek(offset, *args))[1]
+        return remote
+
+
+def test_resumes_after_hard_kill(tmp_path, monkeypatch):
+    monkeypatch.setattr(sftp_transfer, "CHUNK_SIZE", 4)
+    data = b"0123456789abcdef"
+    local = tmp_path / "refunds.csv"
+
+    with pytest.raises(KeyboardInterrupt):
+        resumable_download(FakeSFTP(data, fail_after=8), "/remote/refunds.csv", local)
+    part = tmp_path / "refunds.csv.part"
+    assert part.read_bytes() == data[:8]
+    # A killed process never gets to touch the .part file's mtime
+    os.utime(part, None)
+
+    sftp = FakeSFTP(data)
+    resumable_download(sftp, "/remote/refunds.csv", local)
+    assert sftp.offsets == [8]
+    assert local.read_bytes() == data
+    assert int(local.stat().st_mtime) == REMOTE_MTIME
+    assert not part.exists()
+    assert not (tmp_path / "refunds.csv.part.meta").exists()
+
+
+def test_restarts_when_remote_file_changed(tmp_path, monkeypatch):
+    monkeypatch.setattr(sftp_transfer, "CHUNK_SIZE", 4)
+    local = tmp_path / "refunds.csv"
+    with pytest.raises(KeyboardInterrupt):
+        resumable_download(FakeSFTP(b"0123456789abcdef", fail_after=8), "/remote/refunds.csv", local)
+
+    sftp = FakeSFTP(b"a different, longer file")
+    resumable_download(sftp, "/remote/refunds.csv", local)
+    assert sftp.offsets == [0]
+    assert local.read_bytes() == b"a different, longer file"
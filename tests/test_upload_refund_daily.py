@@ -0,0 +1,119 @@
+import io
+from types import SimpleNamespace
+
+import pytest
+
+import upload_refund_daily
+from upload_refund_daily import run_checkpointed
+
+HEADER = "unique_id,created_at\n"
+REMOTE_MTIME = 1_700_000_000
+
+
+class FakeRemoteFile(io.BytesIO):
+    def prefetch(self, size):
+        pass
+
+
+class FakeSFTP:
+    """Remote directory of name → bytes, recording which files were opened"""
+
+    def __init__(self, files):
+        self.files = files
+        self.opened = []
+
+    def listdir_attr(self, path="."):
+        return [self.stat(name) for name in sorted(self.files)]
+
+    def stat(self, path):
+        name = path.rsplit("/", 1)[-1]
+        return SimpleNamespace(filename=name, st_size=len(self.files[name]), st_mtime=REMOTE_MTIME)
+
+    def open(self, path, mode="rb"):
+        name = path.rsplit("/", 1)[-1]
+        self.opened.append(name)
+        return FakeRemoteFile(self.files[name])
+
+
+class FakeUpload:
+    """Stand-in for upload_to_bq that fails for tables containing the fail_on unique_id"""
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.calls = []
+        self.job_ids = []
+
+    def __call__(self, refunds, name, job_id=None):
+        unique_ids = refunds.column("unique_id").to_pylist()
+        self.job_ids.append(job_id)
+        if self.fail_on in unique_ids:
+            raise RuntimeError("load failed")
+        self.calls.append((unique_ids, job_id))
+
+
+@pytest.fixture
+def daily(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload_refund_daily, "DOWNLOAD_DIR", tmp_path)
+    monkeypatch.setattr(upload_refund_daily, "PARQUET_CACHE_MAX_MB", 0)
+    monkeypatch.setattr(upload_refund_daily, "BQ_SINK", "load")
+    sftp = FakeSFTP(
+        {
+            "2024-05-01_refunds_a.csv": (HEADER + "a,2024-05-01 10:00:00\n").encode(),
+            "2024-05-01_refunds_b.csv": (HEADER + "b,2024-05-01 11:00:00\n").encode(),
+        }
+    )
+
+    def run(upload, pipeline=False, mode="truncate"):
+        monkeypatch.setattr(upload_refund_daily, "upload_to_bq", upload)
+        monkeypatch.setattr(upload_refund_daily, "PIPELINE", pipeline)
+        monkeypatch.setattr(upload_refund_daily, "BQ_WRITE_MODE", mode)
+        return run_checkpointed(sftp, "2024-05-01", sftp.listdir_attr())
+
+    return sftp, run
+
+
+def test_rerun_skips_uploaded_files(daily):
+    sftp, run = daily
+    upload = FakeUpload()
+    assert run(upload) == 2
+    assert [ids for ids, _ in upload.calls] == [["a", "b"]]
+    assert upload.calls[0][1] is not None
+
+    sftp.opened.clear()
+    upload = FakeUpload()
+    assert run(upload) == 0
+    assert upload.calls == []
+    assert sftp.opened == []
+
+
+def test_failed_load_is_retried_with_the_same_job_id_without_downloading_again(daily):
+    sftp, run = daily
+    failed = FakeUpload(fail_on="a")
+    with pytest.raises(RuntimeError):
+        run(failed)
+
+    sftp.opened.clear()
+    upload = FakeUpload()
+    assert run(upload) == 2
+    assert sftp.opened == []
+    first_job_id = upload.calls[0][1]
+    assert failed.job_ids == [first_job_id]
+
+    # A changed remote file is fetched again and the whole day reloaded under a new job ID
+    sftp.files["2024-05-01_refunds_b.csv"] = (HEADER + "b,2024-05-01 11:00:00\nc,2024-05-01 12:00:00\n").encode()
+    upload = FakeUpload()
+    assert run(upload) == 3
+    assert sftp.opened == ["2024-05-01_refunds_b.csv"]
+    assert upload.calls[0][0] == ["a", "b", "c"]
+    assert upload.calls[0][1] != first_job_id
+
+
+def test_pipeline_reuploads_only_the_failed_file(daily):
+    sftp, run = daily
+    upload = FakeUpload(fail_on="b")
+    run(upload, pipeline=True, mode="merge")
+    assert [ids for ids, _ in upload.calls] == [["a"]]
+
+    upload = FakeUpload()
+    assert run(upload, pipeline=True, mode="merge") == 1
+    assert [ids for ids, _ in upload.calls] == [["b"]]
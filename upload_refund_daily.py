@@ -5,21 +5,41 @@ Daily Refunds Pipeline:
 - Downloads today's refund CSV files
 - Enforces schema
 - Uploads to BigQuery
+
+Backfill a range of days with --from YYYY-MM-DD [--to YYYY-MM-DD]. Each day is
+processed and committed on its own, up to BACKFILL_PARALLELISM days at once.
 """
 
 import os
+import re
 import sys
 import fnmatch
 import logging
+import argparse
 import posixpath
 from pathlib import Path
-from datetime import datetime
-import glob
-import pandas as pd
+from datetime import date, datetime
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow as pa
 import paramiko
 from google.cloud import bigquery
 from dotenv import load_dotenv
 
+from sftp_transfer import resumable_download, stream_remote_csv
+from download_manifest import DownloadManifest
+from refund_csv import CSV_ENGINES, parse_file
+from refund_schema import enforce_schema
+from bq_load import (
+    ensure_table,
+    to_arrow,
+    load_table,
+    merge_upsert,
+    job_id_for,
+)
+from bq_sink import RefundSink, LoadJobSink, PerFileLoadSink, StorageWriteSink
+from parquet_cache import ParquetCache
+from pipeline import run_pipeline
+
 # -------------------
 # Setup logging
 # -------------------
@@ -38,6 +58,12 @@ SFTP_PORT = int(os.getenv("SFTP_PORT", "22"))
 SFTP_USER = os.getenv("SFTP_USER")
 SFTP_PASS = os.getenv("SFTP_PASS")
 SFTP_REMOTE_DIR = os.getenv("SFTP_REMOTE_DIR", "/refunds")
+# Parse files straight off the SFTP stream instead of landing them in downloads/
+SFTP_STREAM = os.getenv("SFTP_STREAM", "false").lower() == "true"
+# Overlap download, parse and upload of successive files (ignored with SFTP_STREAM).
+# Needs BQ_SINK=storage_write or BQ_WRITE_MODE=merge, so each file can upload on its own.
+PIPELINE = os.getenv("PIPELINE", "false").lower() == "true"
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "2"))
 
 DOWNLOAD_DIR = Path("downloads")
 DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
@@ -47,55 +73,29 @@ DATASET_ID = os.getenv("BQ_DATASET")
 TABLE_ID = os.getenv("BQ_TABLE")
 BQ_TABLE = f"{PROJECT_ID}.{DATASET_ID}.{TABLE_ID}"
 
-# Today’s date pattern
-TODAY_PREFIX = datetime.utcnow().strftime("%Y-%m-%d_refunds_")
-logging.info(f"Looking for refund files with prefix: {TODAY_PREFIX}")
+# CSV parser: "pandas" (default) or "pyarrow" (multithreaded, schema-typed)
+CSV_ENGINE = os.getenv("CSV_ENGINE", "pandas")
 
-# -------------------
-# BigQuery Schema
-# -------------------
-BIGQUERY_SCHEMA = [
-    bigquery.SchemaField("unique_id", "STRING"),
-    bigquery.SchemaField("refund_id", "INTEGER"),
-    bigquery.SchemaField("event_type", "STRING"),
-    bigquery.SchemaField("created_at", "TIMESTAMP"),
-    bigquery.SchemaField("integration", "INTEGER"),
-    bigquery.SchemaField("business_name", "STRING"),
-    bigquery.SchemaField("status", "STRING"),
-    bigquery.SchemaField("domain", "STRING"),
-    bigquery.SchemaField("currency", "STRING"),
-    bigquery.SchemaField("transaction", "INTEGER"),
-    bigquery.SchemaField("dispute", "INTEGER"),
-    bigquery.SchemaField("channel", "STRING"),
-    bigquery.SchemaField("fully_deducted", "BOOLEAN"),
-    bigquery.SchemaField("refunded_by", "STRING"),
-    bigquery.SchemaField("refunded_at", "TIMESTAMP"),
-    bigquery.SchemaField("expected_at", "TIMESTAMP"),
-    bigquery.SchemaField("deducted_amount", "NUMERIC"),
-    bigquery.SchemaField("amount", "NUMERIC"),
-    bigquery.SchemaField("customer_note", "STRING"),
-    bigquery.SchemaField("merchant_note", "STRING"),
-    bigquery.SchemaField("transaction_reference", "STRING"),
-    bigquery.SchemaField("settlement_date", "DATE"),
-    bigquery.SchemaField("settled", "BOOLEAN"),
-    bigquery.SchemaField("customer_id", "INTEGER"),
-    bigquery.SchemaField("customer_email", "STRING"),
-    bigquery.SchemaField("customer_phone", "STRING"),
-    bigquery.SchemaField("customer_first_name", "STRING"),
-    bigquery.SchemaField("customer_last_name", "STRING"),
-    bigquery.SchemaField("customer_code", "STRING"),
-    bigquery.SchemaField("merge_timestamp", "DATE"),
-]
-
-# Mapping from BigQuery type → pandas dtype
-BQ_TO_PD_DTYPES = {
-    "STRING": "string",
-    "INTEGER": "Int64",
-    "NUMERIC": "float64",
-    "BOOLEAN": "boolean",
-    "DATE": "string",
-    "TIMESTAMP": "datetime64[ns]",
-}
+# "truncate" replaces the table with today's rows, "merge" upserts them on unique_id.
+# ("partition" is for the full rebuild in initial_upload_to_bq.py only: a day's files
+# also hold rows created on earlier days, and truncating those partitions with just
+# these rows would wipe the rows already loaded there.)
+BQ_WRITE_MODE = os.getenv("BQ_WRITE_MODE", "truncate")
+DAILY_WRITE_MODES = ("truncate", "merge")
+
+# Parsed files are cached as Parquet by content hash; 0 disables the cache
+PARQUET_CACHE_MAX_MB = int(os.getenv("PARQUET_CACHE_MAX_MB", "10240"))
+
+# "load" batches the day into load jobs, "storage_write" appends each parsed file
+# through the Storage Write API ("committed" or "pending" stream)
+BQ_SINK = os.getenv("BQ_SINK", "load")
+BQ_STORAGE_WRITE_MODE = os.getenv("BQ_STORAGE_WRITE_MODE", "committed")
+
+# Days processed at once in a --from/--to backfill
+BACKFILL_PARALLELISM = int(os.getenv("BACKFILL_PARALLELISM", "2"))
+
+# Refund files are named YYYY-MM-DD_refunds_*.csv
+FILE_DAY_RE = re.compile(r"^(\d{4}-\d{2}-\d{2})_refunds_")
 
 
 # -------------------
@@ -110,110 +110,260 @@ def connect_sftp():
     return sftp, transport
 
 
-def list_today_files(sftp):
-    """List today’s refund files from remote dir"""
+def day_prefix(day: date) -> str:
+    """File name prefix of one day's refund files"""
+    return day.strftime("%Y-%m-%d_refunds_")
+
+
+def list_files_by_day(sftp, start: date, end: date):
+    """List the remote dir once and group SFTPAttributes of refund files by day, for start..end inclusive"""
     try:
-        names = sftp.listdir(SFTP_REMOTE_DIR)
+        attrs = sftp.listdir_attr(SFTP_REMOTE_DIR)
     except IOError as e:
         logging.error(f"Failed to list directory {SFTP_REMOTE_DIR}: {e}")
-        return []
-    files = [n for n in names if n.startswith(TODAY_PREFIX)]
-    logging.info(f"Found {len(files)} files for today")
-    return files
-
-
-def download_file(sftp, filename):
-    remote_path = posixpath.join(SFTP_REMOTE_DIR, filename)
-    local_path = DOWNLOAD_DIR / filename
-    logging.info(f"Downloading {remote_path} -> {local_path}")
-    sftp.get(remote_path, str(local_path))
-    return local_path
-
-
-def enforce_schema(df: pd.DataFrame) -> pd.DataFrame:
-    """Ensure dataframe matches the BigQuery schema exactly"""
-    df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_')
-    for field in BIGQUERY_SCHEMA:
-        col, bq_type = field.name, field.field_type
-        if col not in df.columns:
-            df[col] = pd.NA
+        return {}
+    days = {}
+    for attr in attrs:
+        match = FILE_DAY_RE.match(attr.filename)
+        if not match:
+            continue
         try:
-            if bq_type == "TIMESTAMP":
-                df[col] = pd.to_datetime(df[col], errors="coerce")
-            elif bq_type == "DATE":
-                df[col] = pd.to_datetime(df[col], errors="coerce").dt.date
-            elif bq_type == "NUMERIC":
-                df[col] = df[col].astype("float64").astype(str).map(decimal.Decimal)
-            else:
-                df[col] = df[col].astype(BQ_TO_PD_DTYPES[bq_type], errors="ignore")
-        except Exception as e:
-            logging.error(f"Failed casting {col}: {e}")
-            df[col] = pd.NA
-    return df[[f.name for f in BIGQUERY_SCHEMA]]
-
-
-def load_csvs() -> pd.DataFrame:
-    csv_files = glob.glob(str(DOWNLOAD_DIR / f"{TODAY_PREFIX}*.csv"))
-    if not csv_files:
-        logging.warning("No local CSVs found for today")
-        return None
-    dfs = []
-    for f in csv_files:
+            day = date.fromisoformat(match.group(1))
+        except ValueError:
+            continue
+        if start <= day <= end:
+            days.setdefault(day, []).append(attr)
+    logging.info(f"Found {sum(map(len, days.values()))} files for {len(days)} days between {start} and {end}")
+    return dict(sorted(days.items()))
+
+
+def download_file(sftp, attr):
+    remote_path = posixpath.join(SFTP_REMOTE_DIR, attr.filename)
+    local_path = DOWNLOAD_DIR / attr.filename
+    return resumable_download(sftp, remote_path, local_path, attr=attr)
+
+
+def parse_downloaded(manifest: DownloadManifest, attr, cache: ParquetCache = None, engine: str = CSV_ENGINE):
+    """
+    Parse a downloaded file, through the Parquet cache if there is one. The
+    cache (keyed by content hash, schema and parser version) is the parse
+    checkpoint: an unchanged file is read back instead of reparsed.
+    """
+    if engine not in CSV_ENGINES:
+        raise ValueError(f"Unknown CSV engine {engine!r}, expected one of {CSV_ENGINES}")
+    path = DOWNLOAD_DIR / attr.filename
+    if cache is None:
+        return parse_file(path, engine)
+    return cache.load(path, engine, lambda p: parse_file(p, engine), manifest.sha256(attr.filename))
+
+
+def stream_csvs(sftp, files):
+    """Yield one Arrow table per remote file, parsed chunk by chunk without touching local disk"""
+    for attr in files:
+        remote_path = posixpath.join(SFTP_REMOTE_DIR, attr.filename)
         try:
-            df = pd.read_csv(f)
-            df = enforce_schema(df)
-            dfs.append(df)
+            chunks = [to_arrow(enforce_schema(chunk)) for chunk in stream_remote_csv(sftp, remote_path, attr=attr)]
         except Exception as e:
-            logging.error(f"Failed processing {f}: {e}")
-    if not dfs:
-        return None
-    return pd.concat(dfs, ignore_index=True)
+            logging.error(f"Failed processing {remote_path}: {e}")
+            continue
+        if chunks:
+            yield pa.concat_tables(chunks)
 
 
-def upload_to_bq(df: pd.DataFrame):
+def upload_to_bq(refunds: pa.Table, name: str, mode: str = BQ_WRITE_MODE, job_id=None):
     client = bigquery.Client()
-    job_config = bigquery.LoadJobConfig(
-        schema=BIGQUERY_SCHEMA,
-        write_disposition="WRITE_TRUNCATE",
-    )
-    logging.info(f"Uploading {len(df)} rows to {BQ_TABLE}")
-    job = client.load_table_from_dataframe(df, BQ_TABLE, job_config=job_config)
-    job.result()
-    logging.info(f"Upload complete. {job.output_rows} rows loaded.")
+    if mode == "merge":
+        merge_upsert(client, refunds, BQ_TABLE, name, job_id=job_id)
+        return
+    logging.info(f"Uploading {refunds.num_rows} rows to {BQ_TABLE}")
+    ensure_table(client, BQ_TABLE)
+    rows = load_table(client, refunds, BQ_TABLE, name, "WRITE_TRUNCATE", job_id)
+    logging.info(f"Upload complete. {rows} rows loaded.")
+
+
+def open_sink(
+    upload, sink: str = BQ_SINK, table: str = BQ_TABLE, mode: str = BQ_STORAGE_WRITE_MODE, per_file: bool = False
+) -> RefundSink:
+    """
+    Sink for parsed tables: one upload(refunds) batch load (default), an
+    upload(refunds) per file if per_file, or a Storage Write API stream
+    """
+    if sink == "storage_write":
+        return StorageWriteSink(table, mode=mode)
+    if per_file:
+        return PerFileLoadSink(upload)
+    return LoadJobSink(upload)
+
+
+def run_checkpointed(sftp, name: str, files) -> int:
+    """
+    Download, parse and upload files, checkpointing downloads and uploads per
+    file in the manifest. A re-run skips downloads of unchanged files, reads
+    their parsed tables from the Parquet cache instead of reparsing, and skips
+    files already uploaded. Load jobs get IDs derived from the files' hashes,
+    so a retry racing a job that actually succeeded picks that job up instead
+    of loading the rows twice.
+    With PIPELINE, the stages overlap: file N+1 downloads while file N parses
+    and file N-1 uploads, either appended to the Storage Write stream or, with
+    the load sink, MERGEd on its own.
+    """
+    with DownloadManifest(DOWNLOAD_DIR) as manifest:
+        pending = {attr.filename for attr in manifest.pending(files)}
+        todo = [attr for attr in files if attr.filename in pending or not manifest.stage(attr.filename, "upload")]
+        if not todo:
+            logging.info(f"All {len(files)} files for {name} are already uploaded. Skipping.")
+            return 0
+        # In the pipeline, load-sink files are MERGEd one by one as they arrive
+        per_file = PIPELINE and BQ_SINK == "load"
+        # A single load job replaces the day's rows as a whole, so it needs every file, not just the new ones
+        if BQ_SINK == "load" and not per_file:
+            todo = files
+
+        cache = ParquetCache(max_bytes=PARQUET_CACHE_MAX_MB * 1024**2) if PARQUET_CACHE_MAX_MB else None
+        # unsent: files written to the sink whose rows upload() hasn't loaded yet
+        written, unsent, job_ids = [], [], {}
+
+        def upload(refunds):
+            job_id = job_id_for(BQ_TABLE, BQ_WRITE_MODE, [manifest.sha256(attr.filename) for attr in unsent])
+            upload_to_bq(refunds, name, job_id=job_id)
+            for attr in unsent:
+                job_ids[attr.filename] = job_id
+            unsent.clear()
+
+        sink = open_sink(upload, per_file=per_file)
+
+        def fetch(attr):
+            if attr.filename in pending:
+                manifest.record(attr, download_file(sftp, attr))
+            return attr
+
+        def parse(attr):
+            return attr, parse_downloaded(manifest, attr, cache)
+
+        # Per-file MERGEs and committed Storage Write appends are in the table as soon as
+        # write()/flush() return, so those files are checkpointed one by one; the rest once the sink closes
+        commit_per_file = per_file or (BQ_SINK == "storage_write" and BQ_STORAGE_WRITE_MODE == "committed")
+
+        def send(parsed):
+            attr, table = parsed
+            unsent.append(attr)
+            try:
+                sink.write(table)
+                sink.flush()
+            except Exception:
+                unsent.remove(attr)
+                raise
+            if commit_per_file:
+                manifest.mark(attr.filename, "upload", job_id=job_ids.get(attr.filename))
+            written.append(attr)
+
+        if PIPELINE:
+            run_pipeline(
+                ((attr.filename, attr) for attr in todo),
+                [("download", fetch), ("parse", parse), ("upload", send)],
+                queue_size=PIPELINE_QUEUE_SIZE,
+            )
+        else:
+            for attr in todo:
+                fetch(attr)
+            for attr in todo:
+                try:
+                    send(parse(attr))
+                except Exception as e:
+                    logging.error(f"Failed processing {attr.filename}: {e}")
+
+        # Per-file and Storage Write sinks have already sent their rows; a batch load sink uploads here
+        rows = sink.close()
+        if cache:
+            cache.evict()
+        if not commit_per_file:
+            for attr in written:
+                manifest.mark(attr.filename, "upload", job_id=job_ids.get(attr.filename))
+        if not rows:
+            logging.error(f"No data to upload for {name}.")
+        return rows
+
+
+def run_day(transport, day: date, files) -> int:
+    """
+    Download, parse and upload one day's files on its own SFTP channel and sink,
+    so each day commits independently of the others. Returns rows uploaded.
+    """
+    prefix = day_prefix(day)
+    name = prefix.rstrip("_")
+    logging.info(f"Processing {len(files)} files with prefix: {prefix}")
+
+    sftp = paramiko.SFTPClient.from_transport(transport)
+    try:
+        if not SFTP_STREAM:
+            return run_checkpointed(sftp, name, files)
+        # Parse and upload in-stream; nothing lands on disk, so there is nothing to checkpoint
+        sink = open_sink(lambda refunds: upload_to_bq(refunds, name))
+        for table in stream_csvs(sftp, files):
+            sink.write(table)
+        rows = sink.close()
+        if not rows:
+            logging.error(f"No data to upload for {day}.")
+        return rows
+    finally:
+        sftp.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Upload Paystack refund files for today (UTC) or a range of days")
+    parser.add_argument("--from", dest="start", type=date.fromisoformat, help="first day to load, YYYY-MM-DD")
+    parser.add_argument("--to", dest="end", type=date.fromisoformat, help="last day to load (default: today)")
+    args = parser.parse_args(argv)
+    if BQ_WRITE_MODE not in DAILY_WRITE_MODES:
+        parser.error(f"the daily job supports BQ_WRITE_MODE {DAILY_WRITE_MODES}, not {BQ_WRITE_MODE}")
+    args.end = args.end or datetime.utcnow().date()
+    args.start = args.start or args.end
+    if args.start > args.end:
+        parser.error(f"--from {args.start} is after --to {args.end}")
+    # Per-file uploads in the pipeline only compose as MERGEs (or Storage Write appends)
+    if PIPELINE and not SFTP_STREAM and BQ_SINK == "load" and BQ_WRITE_MODE != "merge":
+        parser.error(f"PIPELINE with BQ_SINK=load needs BQ_WRITE_MODE=merge, not {BQ_WRITE_MODE}")
+    # Each day is uploaded separately, so whole-table truncates would overwrite each other
+    if args.start < args.end and BQ_SINK == "load" and BQ_WRITE_MODE != "merge":
+        parser.error(f"backfilling a range needs BQ_WRITE_MODE=merge or BQ_SINK=storage_write, not {BQ_WRITE_MODE}")
+    return args
 
 
 # -------------------
 # Main
 # -------------------
-def main():
-    # Step 1: SFTP → download today’s files
+def main(argv=None):
+    args = parse_args(argv)
+
     try:
         sftp, transport = connect_sftp()
-        files = list_today_files(sftp)
-        if not files:
-            logging.info("No files to download today. Exiting.")
-            return
-        for fname in files:
-            download_file(sftp, fname)
     except Exception as e:
         logging.error(f"SFTP step failed: {e}")
         sys.exit(1)
+
+    failed = []
+    try:
+        days = list_files_by_day(sftp, args.start, args.end)
+        sftp.close()
+        if not days:
+            logging.info("No files to download. Exiting.")
+            return
+
+        with ThreadPoolExecutor(max_workers=BACKFILL_PARALLELISM) as pool:
+            futures = {day: pool.submit(run_day, transport, day, files) for day, files in days.items()}
+            for day, future in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    logging.error(f"Day {day} failed: {e}")
+                    failed.append(day)
     finally:
-        try:
-            sftp.close()
-            transport.close()
-        except Exception:
-            pass
-
-    # Step 2: Load CSVs and enforce schema
-    df = load_csvs()
-    if df is None:
-        logging.error("No data to upload. Exiting.")
-        return
+        transport.close()
 
-    # Step 3: Upload to BigQuery
-    upload_to_bq(df)
+    if failed:
+        logging.error(f"{len(failed)} of {len(days)} days failed: {', '.join(map(str, failed))}")
+        sys.exit(1)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()